@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Storing benchmark baselines and comparing results against them.
+
+A baseline is a JSON file mapping benchmark names to a time in seconds.
+Timings only compare meaningfully on the machine that recorded them, so
+baselines should be refreshed (with `--save`) when the hardware changes.
+"""
+
+import json
+import os
+import sys
+from typing import IO, Dict, Final, List, Mapping, NamedTuple, Optional
+
+DEFAULT_THRESHOLD: Final[float] = 1.25
+
+
+class Comparison(NamedTuple):
+    """Result of one benchmark compared to its baseline."""
+
+    name: str
+    seconds: float
+    baseline: Optional[float]
+
+    @property
+    def ratio(self) -> Optional[float]:
+        """Get time relative to the baseline."""
+        return self.seconds / self.baseline if self.baseline else None
+
+
+def load(path: str) -> Dict[str, float]:
+    """Load a baseline, or return an empty one if there is none."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as baseline_file:
+        return {str(name): float(seconds) for name, seconds in json.load(baseline_file).items()}
+
+
+def save(path: str, results: Mapping[str, float]) -> None:
+    """Save results as the new baseline."""
+    with open(path, "w", encoding="utf-8") as baseline_file:
+        json.dump(
+            {name: float(f"{seconds:.4g}") for name, seconds in sorted(results.items())},
+            baseline_file,
+            indent=2,
+        )
+        baseline_file.write("\n")
+
+
+def compare(results: Mapping[str, float], baseline: Mapping[str, float]) -> List[Comparison]:
+    """Compare results with a baseline."""
+    return [Comparison(name, seconds, baseline.get(name)) for name, seconds in results.items()]
+
+
+def report(
+    comparisons: List[Comparison], threshold: float, unit: str = "us", file: IO[str] = sys.stdout
+) -> int:
+    """Print comparisons, returning 1 if any is slower than threshold times its baseline."""
+    scale = {"s": 1.0, "ms": 1e3, "us": 1e6}[unit]
+    status = 0
+    width = max((len(one.name) for one in comparisons), default=0)
+    for one in comparisons:
+        line = f"{one.name:<{width}}  {one.seconds * scale:12.3f} {unit}"
+        ratio = one.ratio
+        if ratio is not None:
+            line += f"  {ratio:6.2f}x baseline"
+            if ratio > threshold:
+                line += "  REGRESSION"
+                status = 1
+        else:
+            line += "  (no baseline)"
+        print(line, file=file)
+    return status
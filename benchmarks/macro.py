@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+"""Macro-benchmark of `set_mode_recursive` on generated directory trees.
+
+Run from the repository root:
+
+    python -m benchmarks.macro --files 100000 --output results.json
+    python -m benchmarks.macro --root /dev/shm --fan-out 4 --depth 6 --files 1000000
+
+A synthetic tree (directories of `--fan-out` subdirectories, `--depth`
+levels deep, holding up to `--files` files, some of them symbolic or hard
+links) is generated under `--root`, then each engine (walkers, threads and
+processes) sets octal and symbolic modes on it in a fresh process. Each
+case reports throughput in entries per second, file system calls per entry
+and peak resident memory, and all results are written as JSON. Trees are
+generated from a fixed seed, so the same arguments give the same tree.
+
+File system calls are counted in a separate, untimed run of each case, by
+wrapping the `os` functions oschmod uses and the `stat()` of the directory
+entries they list (only its first call per entry reaches the system). With
+the process engine, calls made by worker processes are counted in each
+worker and added up; the few calls starting the pool are included. Calls
+the C library makes on its own (e.g., `DirEntry.is_dir()` on file systems
+without entry types) are not seen.
+"""
+
+import argparse
+import contextlib
+import functools
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Callable, Dict, Final, Iterator, List, NamedTuple, Optional, Tuple
+
+import oschmod
+from benchmarks import baseline
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None  # type: ignore[assignment]
+
+COUNTED_CALLS: Final[Tuple[str, ...]] = (
+    "chmod",
+    "close",
+    "fchmod",
+    "fstat",
+    "lstat",
+    "open",
+    "scandir",
+    "stat",
+)
+MODES: Final[Dict[str, Tuple[oschmod.ModeInputValue, oschmod.ModeInputValue]]] = {
+    "octal": (0o644, 0o755),
+    "symbolic": ("u=rw,go=r", "u=rwx,go=rx"),
+}
+ENTRY_STAT: Final[str] = "DirEntry.stat"
+RESET_MODES: Final[Tuple[int, int]] = (0o600, 0o700)
+SEED: Final[int] = 1
+SHARD_CALLS_ENV: Final[str] = "OSCHMOD_BENCH_SHARD_CALLS"
+
+_SET_MODE_SHARD: Final = oschmod._set_mode_shard  # pylint: disable=protected-access
+
+
+class TreeSpec(NamedTuple):
+    """Shape of a generated tree."""
+
+    fan_out: int
+    depth: int
+    files: int
+    symlink_ratio: float
+    hardlink_ratio: float
+
+
+class Engine(NamedTuple):
+    """Keyword arguments of `set_mode_recursive` for one engine."""
+
+    name: str
+    kwargs: Dict[str, Any]
+
+
+def generate_tree(root: str, spec: TreeSpec) -> int:
+    """Generate a tree under root, returning the number of entries below root."""
+    rng = random.Random(SEED)
+    dirs = [root]
+    level = [root]
+    for _ in range(spec.depth):
+        level = [
+            os.path.join(parent, f"d{index}") for parent in level for index in range(spec.fan_out)
+        ]
+        dirs.extend(level)
+    for path in dirs[1:]:
+        os.mkdir(path)
+
+    entries = len(dirs) - 1
+    per_dir, extra = divmod(spec.files, len(dirs))
+    targets: List[str] = []
+    for index, path in enumerate(dirs):
+        for number in range(per_dir + (index < extra)):
+            file_path = os.path.join(path, f"f{number}")
+            draw = rng.random()
+            if targets and draw < spec.symlink_ratio:
+                os.symlink(rng.choice(targets), file_path)
+            elif targets and draw < spec.symlink_ratio + spec.hardlink_ratio:
+                os.link(rng.choice(targets), file_path)
+            else:
+                with open(file_path, "w", encoding="utf-8"):
+                    pass
+                targets.append(file_path)
+            entries += 1
+    return entries
+
+
+def get_engines(workers: int, processes: int) -> List[Engine]:
+    """Get the engines to compare."""
+    engines = [
+        Engine("scandir", {"walker": oschmod.ModeWalker.SCANDIR}),
+        Engine("walk", {"walker": oschmod.ModeWalker.WALK}),
+    ]
+    if workers > 1:
+        engines.append(Engine(f"threads-{workers}", {"workers": workers}))
+    if processes > 1:
+        engines.append(Engine(f"processes-{processes}", {"processes": processes}))
+    return engines
+
+
+class _CountedEntry:
+    """Directory entry counting the calls of its `stat()` that reach the system."""
+
+    __slots__ = ("_entry", "_calls", "_cached")
+
+    def __init__(self, entry: "os.DirEntry[str]", calls: Dict[str, int]) -> None:
+        """Wrap an entry."""
+        self._entry = entry
+        self._calls = calls
+        self._cached: List[bool] = []
+
+    def __getattr__(self, name: str) -> Any:
+        """Get attributes of the wrapped entry."""
+        return getattr(self._entry, name)
+
+    def stat(self, *, follow_symlinks: bool = True) -> os.stat_result:
+        """Stat the entry, counting the call unless its result is cached."""
+        # entries cache one result for links followed, one for everything else
+        followed = follow_symlinks and self._entry.is_symlink()
+        if followed not in self._cached:
+            self._cached.append(followed)
+            self._calls[ENTRY_STAT] += 1
+        return self._entry.stat(follow_symlinks=follow_symlinks)
+
+
+class _CountedScandir:
+    """Iterator of `os.scandir()` giving entries that count their stat calls."""
+
+    __slots__ = ("_iterator", "_calls")
+
+    def __init__(self, iterator: Any, calls: Dict[str, int]) -> None:
+        """Wrap a scandir iterator."""
+        self._iterator = iterator
+        self._calls = calls
+
+    def __iter__(self) -> "_CountedScandir":
+        """Return the iterator itself."""
+        return self
+
+    def __next__(self) -> _CountedEntry:
+        """Get the next entry, wrapped."""
+        return _CountedEntry(next(self._iterator), self._calls)
+
+    def __enter__(self) -> "_CountedScandir":
+        """Enter a context closing the iterator."""
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """Close the iterator."""
+        self._iterator.close()
+
+    def close(self) -> None:
+        """Close the iterator."""
+        self._iterator.close()
+
+
+def _counting(calls: Dict[str, int], name: str, func: Callable[..., Any]) -> Callable[..., Any]:
+    """Wrap a function to count its calls."""
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        calls[name] += 1
+        result = func(*args, **kwargs)
+        return _CountedScandir(result, calls) if name == "scandir" else result
+
+    return wrapper
+
+
+@contextlib.contextmanager
+def _counting_calls() -> Iterator[Dict[str, int]]:
+    """Count file system calls made in this process, until the context exits."""
+    calls = dict.fromkeys((*COUNTED_CALLS, ENTRY_STAT), 0)
+    originals = {name: getattr(os, name) for name in COUNTED_CALLS if hasattr(os, name)}
+    for name, func in originals.items():
+        setattr(os, name, _counting(calls, name, func))
+    try:
+        yield calls
+    finally:
+        for name, func in originals.items():
+            setattr(os, name, func)
+
+
+def _count_shard(*args: Any, **kwargs: Any) -> oschmod.ModeCounts:
+    """Set modes of a subtree in a worker process, saving the calls made."""
+    with _counting_calls() as calls:
+        counts: oschmod.ModeCounts = _SET_MODE_SHARD(*args, **kwargs)
+    path = os.path.join(os.environ[SHARD_CALLS_ENV], f"{uuid.uuid4().hex}.json")
+    with open(path, "w", encoding="utf-8") as output:
+        json.dump(calls, output)
+    return counts
+
+
+def count_calls(root: str, file_mode: Any, dir_mode: Any, engine: Engine) -> Dict[str, int]:
+    """Count file system calls setting modes of a tree once, worker processes included."""
+    oschmod.set_mode_recursive(root, *RESET_MODES)
+    oschmod.clear_path_cache()
+    with tempfile.TemporaryDirectory(prefix="oschmod-calls-") as shard_dir:
+        os.environ[SHARD_CALLS_ENV] = shard_dir
+        oschmod._set_mode_shard = _count_shard  # pylint: disable=protected-access
+        try:
+            with _counting_calls() as calls:
+                oschmod.set_mode_recursive(root, file_mode, dir_mode, **engine.kwargs)
+        finally:
+            oschmod._set_mode_shard = _SET_MODE_SHARD  # pylint: disable=protected-access
+            del os.environ[SHARD_CALLS_ENV]
+        for name in os.listdir(shard_dir):
+            with open(os.path.join(shard_dir, name), encoding="utf-8") as shard_calls:
+                for call, count in json.load(shard_calls).items():
+                    calls[call] += count
+    return calls
+
+
+def _get_peak_rss_kb() -> Optional[int]:
+    """Get peak resident memory of this process and its children, in KiB."""
+    if resource is None:
+        return None
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def run_case(root: str, mode_name: str, engine: Engine) -> Dict[str, Any]:
+    """Set modes of a tree once with an engine, in this (fresh) process."""
+    file_mode, dir_mode = MODES[mode_name]
+    oschmod.set_mode_recursive(root, *RESET_MODES)
+    oschmod.clear_path_cache()
+
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    oschmod.set_mode_recursive(root, file_mode, dir_mode, **engine.kwargs)
+    seconds = time.perf_counter() - start
+    cpu_seconds = time.process_time() - cpu_start
+    peak_rss_kb = _get_peak_rss_kb()
+    return {
+        "seconds": seconds,
+        "cpu_seconds": cpu_seconds,
+        # counting slows calls down, so it is done after timing
+        "calls": count_calls(root, file_mode, dir_mode, engine),
+        "peak_rss_kb": peak_rss_kb,
+    }
+
+
+def run(root: str, entries: int, engines: List[Engine], repeat: int) -> Iterator[Dict[str, Any]]:
+    """Run every engine with every mode, yielding the best result of each."""
+    for engine in engines:
+        for mode_name in MODES:
+            runs = []
+            for _ in range(repeat):
+                with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+                    runs.append(executor.submit(run_case, root, mode_name, engine).result())
+            best = min(runs, key=lambda one: one["seconds"])
+            total_calls = sum(best["calls"].values())
+            yield {
+                "case": f"{engine.name}/{mode_name}",
+                "engine": engine.name,
+                "mode": mode_name,
+                "seconds": best["seconds"],
+                "cpu_seconds": best["cpu_seconds"],
+                "entries_per_second": entries / best["seconds"],
+                "calls": best["calls"],
+                "calls_per_entry": total_calls / entries,
+                "peak_rss_kb": max(one["peak_rss_kb"] or 0 for one in runs) or None,
+            }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Generate a tree, benchmark recursive mode changes and write JSON results."""
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.macro", description=__doc__)
+    parser.formatter_class = argparse.RawDescriptionHelpFormatter
+    parser.add_argument("--root", help="directory to generate the tree in (e.g., a tmpfs)")
+    parser.add_argument("--fan-out", type=int, default=8, help="subdirectories per directory")
+    parser.add_argument("--depth", type=int, default=3, help="levels of subdirectories")
+    parser.add_argument("--files", type=int, default=20000, help="number of files")
+    parser.add_argument(
+        "--symlinks", type=float, default=0.01, help="fraction of files that are symbolic links"
+    )
+    parser.add_argument(
+        "--hardlinks", type=float, default=0.01, help="fraction of files that are hard links"
+    )
+    parser.add_argument("-j", "--workers", type=int, default=8, help="threads of thread engine")
+    parser.add_argument(
+        "--processes", type=int, default=os.cpu_count() or 1, help="processes of process engine"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case (best is kept)")
+    parser.add_argument("-o", "--output", help="JSON file to write (default: standard output)")
+    parser.add_argument("--baseline", help="JSON baseline of seconds per entry to compare with")
+    parser.add_argument("--save", action="store_true", help="save results as the baseline")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=baseline.DEFAULT_THRESHOLD,
+        help="slowdown relative to the baseline reported as a regression",
+    )
+    args = parser.parse_args(argv)
+
+    spec = TreeSpec(args.fan_out, args.depth, args.files, args.symlinks, args.hardlinks)
+    workdir = tempfile.mkdtemp(prefix="oschmod-bench-", dir=args.root)
+    try:
+        root = os.path.join(workdir, "tree")
+        os.mkdir(root)
+        start = time.perf_counter()
+        entries = generate_tree(root, spec)
+        generate_seconds = time.perf_counter() - start
+        results = list(run(root, entries, get_engines(args.workers, args.processes), args.repeat))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    document = {
+        "oschmod": oschmod.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "tree": {**spec._asdict(), "entries": entries, "generate_seconds": generate_seconds},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(document, output, indent=2)
+            output.write("\n")
+    else:
+        print(json.dumps(document, indent=2))
+
+    if not args.baseline:
+        return 0
+    per_entry = {result["case"]: result["seconds"] / entries for result in results}
+    if args.save:
+        baseline.save(args.baseline, {**baseline.load(args.baseline), **per_entry})
+    return baseline.report(
+        baseline.compare(per_entry, baseline.load(args.baseline)),
+        args.threshold,
+        "us",
+        sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
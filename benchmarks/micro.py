@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""Micro-benchmarks of the mode computation and path hot paths.
+
+Run from the repository root:
+
+    python -m benchmarks.micro            # compare with benchmarks/micro.json
+    python -m benchmarks.micro --save     # record a new baseline
+    python -m benchmarks.micro -k to_path # only benchmarks whose name matches
+
+The exit status is 1 if any benchmark is slower than its baseline by more
+than the threshold (default 1.25, i.e. 25%).
+"""
+
+import argparse
+import array
+import os
+import sys
+import tempfile
+import timeit
+from typing import Callable, Dict, Final, List, Optional
+
+import oschmod
+from benchmarks import baseline
+
+BASELINE_FILE: Final[str] = os.path.join(os.path.dirname(__file__), "micro.json")
+REPEAT: Final[int] = 9
+
+Benchmark = Callable[[str], Callable[[], object]]
+
+
+def _make_file(workdir: str) -> str:
+    """Create a file to benchmark against."""
+    path = os.path.join(workdir, "file")
+    with open(path, "w", encoding="utf-8"):
+        pass
+    return path
+
+
+def _get_effective_mode_single(_: str) -> Callable[[], object]:
+    return lambda: oschmod.get_effective_mode(0o644, "u+x")
+
+
+def _get_effective_mode_multiple(_: str) -> Callable[[], object]:
+    return lambda: oschmod.get_effective_mode(0o644, "u+rwx,g-w,o=r,a+x")
+
+
+def _mode_spec_compile_uncached(_: str) -> Callable[[], object]:
+    return lambda: oschmod.ModeSpec("u+rwx,g-w,o=r,a+x")
+
+
+def _get_effective_modes(_: str) -> Callable[[], object]:
+    modes = array.array("H", [0o644, 0o755, 0o600, 0o700] * 2500)
+    return lambda: oschmod.get_effective_modes(modes, "u+rwx,g-w,o=r")
+
+
+def _get_basic_symbol_to_mode(_: str) -> Callable[[], object]:
+    return lambda: oschmod._get_basic_symbol_to_mode("rwx")  # pylint: disable=protected-access
+
+
+def _to_path(workdir: str) -> Callable[[], object]:
+    path = _make_file(workdir)
+    return lambda: oschmod._to_path(path)  # pylint: disable=protected-access
+
+
+def _to_path_relative(workdir: str) -> Callable[[], object]:
+    path = os.path.relpath(_make_file(workdir))
+    return lambda: oschmod._to_path(path)  # pylint: disable=protected-access
+
+
+def _set_mode(mode: oschmod.ModeInputValue) -> Benchmark:
+    def setup(workdir: str) -> Callable[[], object]:
+        path = _make_file(workdir)
+        return lambda: oschmod._set_mode(path, mode)  # pylint: disable=protected-access
+
+    return setup
+
+
+def _convert_stat_to_win(_: str) -> Callable[[], object]:
+    return lambda: oschmod.convert_stat_to_win(
+        0o754, oschmod.ModeUserType.GROUP, oschmod.ModeObjectType.FILE
+    )
+
+
+def _convert_win_to_stat(_: str) -> Callable[[], object]:
+    win_perm = oschmod.convert_stat_to_win(
+        0o754, oschmod.ModeUserType.GROUP, oschmod.ModeObjectType.FILE
+    )
+    return lambda: oschmod.convert_win_to_stat(
+        win_perm, oschmod.ModeUserType.GROUP, oschmod.ModeObjectType.FILE
+    )
+
+
+BENCHMARKS: Final[Dict[str, Benchmark]] = {
+    "get_effective_mode_single": _get_effective_mode_single,
+    "get_effective_mode_multiple": _get_effective_mode_multiple,
+    "mode_spec_compile_uncached": _mode_spec_compile_uncached,
+    "get_effective_modes_10000": _get_effective_modes,
+    "get_basic_symbol_to_mode": _get_basic_symbol_to_mode,
+    "to_path": _to_path,
+    "to_path_relative": _to_path_relative,
+    "set_mode_int": _set_mode(0o644),
+    "set_mode_octal_str": _set_mode("644"),
+    "set_mode_symbolic": _set_mode("u=rw,go=r"),
+    "convert_stat_to_win": _convert_stat_to_win,
+    "convert_win_to_stat": _convert_win_to_stat,
+}
+
+
+def measure(func: Callable[[], object]) -> float:
+    """Get the best time of one call, in seconds."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(REPEAT, number)) / number
+
+
+def run(selected: Optional[str] = None) -> Dict[str, float]:
+    """Run benchmarks whose name contains selected, returning seconds per call."""
+    results: Dict[str, float] = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, setup in BENCHMARKS.items():
+            if selected and selected not in name:
+                continue
+            results[name] = measure(setup(tempfile.mkdtemp(dir=workdir)))
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run micro-benchmarks and compare them with the baseline."""
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.micro", description=__doc__)
+    parser.formatter_class = argparse.RawDescriptionHelpFormatter
+    parser.add_argument("-k", metavar="NAME", help="only run benchmarks whose name contains NAME")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline file")
+    parser.add_argument("--save", action="store_true", help="save results as the baseline")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=baseline.DEFAULT_THRESHOLD,
+        help="slowdown relative to the baseline reported as a regression",
+    )
+    args = parser.parse_args(argv)
+
+    results = run(args.k)
+    if args.save:
+        baseline.save(args.baseline, {**baseline.load(args.baseline), **results})
+    return baseline.report(
+        baseline.compare(results, baseline.load(args.baseline)), args.threshold, "us"
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
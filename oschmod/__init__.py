@@ -29,23 +29,50 @@ These bitwise permissions from the stat module can be used with this module:
 # cspell:ignore FGNRD FGNWR FILEX FILRD FILWR FLDIR FRDAT FRDEA FTRAV FWRAT FWREA
 # cspell:ignore GENEX GENRD GENWR getgrgid OPER oper RDCON topdown ugoa WRDAC WROWN
 
+import array
+import collections
+import contextlib
+import functools
+import gzip
+import importlib.util
+import itertools
 import os
 import pathlib
 import platform
 import random
 import re
+import sqlite3
 import stat
 import string
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
 from enum import IntEnum, auto
 from typing import (
     TYPE_CHECKING,
+    IO,
     Any,
+    BinaryIO,
+    Callable,
+    Dict,
     Final,
     Generic,
+    Iterable,
+    Iterator,
     List,
     Mapping,
+    NamedTuple,
     NewType,
     Optional,
+    Set,
     Tuple,
     TypeVar,
     Union,
@@ -54,10 +81,23 @@ from typing import (
 __version__ = "0.3.13"
 
 IS_WINDOWS: Final[bool] = platform.system() == "Windows"
+HAS_DIR_FD: Final[bool] = (
+    os.chmod in os.supports_dir_fd
+    and os.open in os.supports_dir_fd
+    and os.scandir in os.supports_fd
+)
+HAS_LCHMOD: Final[bool] = os.chmod in os.supports_follow_symlinks
+DIR_OPEN_FLAGS: Final[int] = (
+    os.O_RDONLY
+    | getattr(os, "O_DIRECTORY", 0)
+    | getattr(os, "O_NOFOLLOW", 0)
+    | getattr(os, "O_CLOEXEC", 0)
+)
+_DirHandle = Union[int, str]
 
 ModePathInput = Union[pathlib.Path, str]  # pylint: disable=unsubscriptable-object
 ModePathInternal = NewType("ModePathInternal", str)
-ModeInputValue = Union[int, str]
+ModeInputValue = Union[int, str, "ModeSpec"]
 ModeValue = int
 ModeSidObject = Union[Tuple[str, str, Any], str]
 PyACE = Tuple[Tuple[int, int], int, "PySID"]
@@ -314,11 +354,19 @@ except ImportError:
         return struct_group([])
 
 
+if TYPE_CHECKING:
+    import numpy  # pylint: disable=import-error
+
+# numpy is only imported when modes are computed, as importing it is slow
+HAS_NUMPY: Final[bool] = importlib.util.find_spec("numpy") is not None
+
+
 class ModeObjectType(IntEnum):
     """Enum for object type of directory or file."""
 
     FILE = auto()
     DIRECTORY = auto()
+    LINK = auto()
 
 
 class ModeUserType(IntEnum):
@@ -329,6 +377,30 @@ class ModeUserType(IntEnum):
     OTHER = auto()
 
 
+class ModeWalker(IntEnum):
+    """Enum for engine used to walk directory trees."""
+
+    AUTO = auto()
+    SCANDIR = auto()
+    WALK = auto()
+
+
+class ModeSymlinks(IntEnum):
+    """Enum for handling of symbolic links found walking directory trees."""
+
+    FOLLOW = auto()
+    NO_FOLLOW = auto()
+    SKIP = auto()
+
+
+class ModeChangeType(IntEnum):
+    """Enum for difference between saved and live modes."""
+
+    ADDED = auto()
+    REMOVED = auto()
+    CHANGED = auto()
+
+
 class ModeOperationType(IntEnum):
     """Enum for operation type."""
 
@@ -506,6 +578,235 @@ WIN_INHERITANCE_TYPES: Final[PermissionGroup] = PermissionGroup(
 SECURITY_NT_AUTHORITY: Final[PySidValue] = ("SYSTEM", "NT AUTHORITY", 5)
 
 
+SYMBOLIC_MODE_PATTERN: Final["re.Pattern[str]"] = re.compile(r"^\s*([ugoa]*)([-+=])([rwx]*)\s*$")
+MODE_SPEC_CACHE_SIZE: Final[int] = 256
+PATH_CACHE_SIZE: Final[int] = 1024
+
+
+class ModeSpec:
+    """Mode specification compiled once and applied to any number of objects.
+
+    Every octal, decimal or symbolic mode (including comma separated chains
+    such as "u+rw,go-w") reduces to a pair of masks, so that the new mode is
+    always `(current_mode & ~clear_mask) | set_mask`. Absolute modes clear
+    every bit and do not need the current mode at all.
+
+    Use `ModeSpec.compile()` rather than the constructor to share compiled
+    specs through a bounded LRU cache keyed by the spec value.
+    """
+
+    __slots__ = ("spec", "clear_mask", "set_mask", "is_symbolic")
+
+    def __init__(self, spec: Union[int, str]) -> None:
+        """Compile an integer, octal string or symbolic string mode."""
+        self.spec: Union[int, str] = spec
+        self.is_symbolic: bool = False
+        self.clear_mask: ModeValue = -1
+        self.set_mask: ModeValue = 0
+
+        if isinstance(spec, int):
+            self.set_mask = spec
+        elif "+" in spec or "-" in spec or "=" in spec:
+            self.is_symbolic = True
+            self.clear_mask = 0
+            for symbolic in spec.split(","):
+                clause_clear, clause_set = _compile_symbolic_clause(symbolic)
+                self.clear_mask |= clause_clear
+                self.set_mask = (self.set_mask & ~clause_clear) | clause_set
+        else:
+            self.set_mask = int(spec, 8)
+
+    def __repr__(self) -> str:
+        """Return string representation."""
+        return f"ModeSpec({self.spec!r})"
+
+    @staticmethod
+    def compile(mode: ModeInputValue) -> "ModeSpec":
+        """Return the compiled (and cached) spec for a mode."""
+        if isinstance(mode, ModeSpec):
+            return mode
+        return _compile_mode_spec(mode)
+
+    def apply(self, current_mode: ModeValue) -> ModeValue:
+        """Get new mode, given current mode."""
+        return (current_mode & ~self.clear_mask) | self.set_mask
+
+
+@functools.lru_cache(maxsize=MODE_SPEC_CACHE_SIZE)
+def _compile_mode_spec(mode: Union[int, str]) -> ModeSpec:
+    """Compile a mode, memoized by its value."""
+    return ModeSpec(mode)
+
+
+def _compile_symbolic_clause(symbolic: str) -> Tuple[ModeValue, ModeValue]:
+    """Get clear and set masks of a single symbolic mode modifier."""
+    result = SYMBOLIC_MODE_PATTERN.search(symbolic)
+    if result is None:
+        raise AttributeError("bad format of symbolic representation modifier")
+
+    whom = str(result.group(1)) or "ugo"
+    operation = str(result.group(2))
+    perm = str(result.group(3))
+
+    if "a" in whom:
+        whom = "ugo"
+
+    # bitwise magic
+    bit_perm = _get_basic_symbol_to_mode(perm)
+    mask_mode = (
+        (bit_perm << 6 if "u" in whom else 0)
+        | (bit_perm << 3 if "g" in whom else 0)
+        | (bit_perm << 0 if "o" in whom else 0)
+    )
+
+    if operation == "=":
+        # keep only the permissions of users not named, everything else is cleared
+        kept = (
+            (448 if "u" not in whom else 0)
+            | (56 if "g" not in whom else 0)
+            | (7 if "o" not in whom else 0)
+        )
+        return ~kept, mask_mode
+
+    if operation == "+":
+        return 0, mask_mode
+
+    return mask_mode, 0
+
+
+class ModeCounts:
+    """Counts of objects visited when setting modes.
+
+    `changed` is the number of objects whose mode was set (chmod issued) and
+    `unchanged` the number skipped because they were already at their target
+    mode. Counts can be added together, e.g., to merge results of workers.
+    """
+
+    __slots__ = ("changed", "unchanged")
+
+    def __init__(self, changed: int = 0, unchanged: int = 0) -> None:
+        """Create counts."""
+        self.changed = changed
+        self.unchanged = unchanged
+
+    def __repr__(self) -> str:
+        """Return string representation."""
+        return f"ModeCounts(changed={self.changed}, unchanged={self.unchanged})"
+
+    def __eq__(self, other: object) -> bool:
+        """Compare counts."""
+        if not isinstance(other, ModeCounts):
+            return NotImplemented
+        return (self.changed, self.unchanged) == (other.changed, other.unchanged)
+
+    def __iadd__(self, other: "ModeCounts") -> "ModeCounts":
+        """Add other counts to these counts."""
+        self.changed += other.changed
+        self.unchanged += other.unchanged
+        return self
+
+    @property
+    def total(self) -> int:
+        """Return number of objects visited."""
+        return self.changed + self.unchanged
+
+
+RUN_PHASES: Final[Tuple[str, ...]] = ("walk", "compute", "apply")
+
+
+class RunStats(ModeCounts):  # pylint: disable=too-many-instance-attributes
+    """Counts, timings and callbacks of an instrumented mode-setting run.
+
+    Passed as `counts` to `set_mode_recursive()`, the run is instrumented:
+    besides `changed` (chmods issued) and `unchanged` (chmods skipped), it
+    counts entries `visited`, `stats` performed to read current modes,
+    `errors` and `path_bytes` (length of the paths handled), and records
+    the wall and CPU seconds spent in each of `RUN_PHASES` ("walk" listing
+    directories, "compute" reading and computing modes, "apply" setting
+    them) in `wall_times` and `cpu_times`.
+
+    The optional callbacks are called with the path of each object:
+    `on_entry(path, old_mode, new_mode)` once its mode is set (or found
+    already set; the current mode is always read when this is given),
+    `on_error(path, exc)` when it fails, in which case the run continues
+    rather than raising, and `on_dir_done(path)` once a directory and
+    everything below it are done. A directory that cannot be listed is
+    counted in `errors` and reported, then set, but its contents are
+    skipped (as in runs without statistics, even without `on_error`).
+    """
+
+    __slots__ = (
+        "visited",
+        "stats",
+        "errors",
+        "path_bytes",
+        "wall_times",
+        "cpu_times",
+        "on_entry",
+        "on_error",
+        "on_dir_done",
+    )
+
+    def __init__(
+        self,
+        on_entry: Optional[Callable[[str, ModeValue, ModeValue], None]] = None,
+        on_error: Optional[Callable[[str, Exception], None]] = None,
+        on_dir_done: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        """Create empty statistics."""
+        super().__init__()
+        self.visited = 0
+        self.stats = 0
+        self.errors = 0
+        self.path_bytes = 0
+        self.wall_times: Dict[str, float] = dict.fromkeys(RUN_PHASES, 0.0)
+        self.cpu_times: Dict[str, float] = dict.fromkeys(RUN_PHASES, 0.0)
+        self.on_entry = on_entry
+        self.on_error = on_error
+        self.on_dir_done = on_dir_done
+
+    def __repr__(self) -> str:
+        """Return string representation."""
+        return (
+            f"RunStats(visited={self.visited}, changed={self.changed}, "
+            f"unchanged={self.unchanged}, errors={self.errors})"
+        )
+
+    def __iadd__(self, other: ModeCounts) -> "RunStats":
+        """Add other counts (and timings of other statistics) to these."""
+        super().__iadd__(other)
+        if isinstance(other, RunStats):
+            self.visited += other.visited
+            self.stats += other.stats
+            self.errors += other.errors
+            self.path_bytes += other.path_bytes
+            for phase in RUN_PHASES:
+                self.wall_times[phase] += other.wall_times[phase]
+                self.cpu_times[phase] += other.cpu_times[phase]
+        return self
+
+    @property
+    def wall_time(self) -> float:
+        """Return wall seconds spent in all phases."""
+        return sum(self.wall_times.values())
+
+    @property
+    def cpu_time(self) -> float:
+        """Return CPU seconds spent in all phases."""
+        return sum(self.cpu_times.values())
+
+
+def _now() -> Tuple[float, float]:
+    """Get wall and CPU clocks, for `RunStats` phase timings."""
+    return time.perf_counter(), time.thread_time()
+
+
+def _add_time(stats: RunStats, phase: str, started: Tuple[float, float]) -> None:
+    """Add time since started (from `_now()`) to a phase."""
+    stats.wall_times[phase] += time.perf_counter() - started[0]
+    stats.cpu_times[phase] += time.thread_time() - started[1]
+
+
 def _get_mode(path: ModePathInternal) -> ModeValue:
     """Get bitwise mode (stat) of object (dir or file)."""
     if IS_WINDOWS:
@@ -513,49 +814,244 @@ def _get_mode(path: ModePathInternal) -> ModeValue:
     return os.stat(path).st_mode & (stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
 
 
-def get_mode(path: ModePathInput) -> ModeValue:
-    """Get bitwise mode (stat) of object (dir or file)."""
-    return _get_mode(_to_path(path))
+def get_mode(path: ModePathInput, resolve: bool = True) -> ModeValue:
+    """Get bitwise mode (stat) of object (dir or file).
+
+    If `resolve` is False, path is not resolved (see `set_mode()`).
+    """
+    return _get_mode(_to_path(path, resolve))
 
 
-def _set_mode(path: ModePathInternal, mode: ModeInputValue) -> ModeValue:
+def _set_mode(
+    path: ModePathInternal,
+    mode: ModeInputValue,
+    only_changes: bool = False,
+    counts: Optional["ModeCounts"] = None,
+) -> ModeValue:
     """Set bitwise mode (stat) of object (dir or file).
 
     Three types of modes can be used:
     1. Decimal mode - an integer representation of set bits (eg, 512)
     2. Octal mode - a string expressing an octal number (eg, "777")
     3. Symbolic representation - a string with modifier symbols (eg, "+x")
+
+    A precompiled `ModeSpec` is also accepted.
     """
-    if isinstance(mode, int):
-        new_mode = mode
+    spec = ModeSpec.compile(mode)
+    if spec.is_symbolic or only_changes:
+        current_mode = _get_mode(path)
+        new_mode = spec.apply(current_mode)
+        if only_changes and new_mode == current_mode:
+            if counts is not None:
+                counts.unchanged += 1
+            return new_mode
     else:
-        str_mode = str(mode)
-        if "+" in str_mode or "-" in str_mode or "=" in str_mode:
-            new_mode = get_effective_mode(_get_mode(path), str_mode)
-        else:
-            new_mode = int(mode, 8)
+        new_mode = spec.set_mask
 
     if IS_WINDOWS:
         _win_set_permissions(path, new_mode, _get_object_type(path))
     else:
         os.chmod(path, new_mode)
 
+    if counts is not None:
+        counts.changed += 1
     return new_mode
 
 
-def set_mode(path: ModePathInput, mode: ModeInputValue) -> ModeValue:
+def set_mode(
+    path: ModePathInput,
+    mode: ModeInputValue,
+    only_changes: bool = False,
+    resolve: bool = True,
+    counts: Optional[ModeCounts] = None,
+) -> ModeValue:
     """Set bitwise mode (stat) of object (dir or file).
 
     Three types of modes can be used:
     1. Decimal mode - an integer representation of set bits (eg, 512)
     2. Octal mode - a string expressing an octal number (eg, "777")
     3. Symbolic representation - a string with modifier symbols (eg, "+x")
+
+    A precompiled `ModeSpec` is also accepted. If `only_changes` is True, the
+    mode is only set when it differs from the current mode. If `resolve` is
+    False, path is only made absolute rather than resolved and checked,
+    which is cheaper for deep paths; a missing path then raises the
+    `FileNotFoundError` of the underlying call. If `counts` is given, it is
+    incremented as by `set_mode_recursive()`, including `RunStats`.
     """
-    return _set_mode(_to_path(path), mode)
+    if isinstance(counts, RunStats):
+        return _set_mode_instrumented(
+            None, None, _to_path(path, resolve), ModeSpec.compile(mode), only_changes, counts
+        )
+    return _set_mode(_to_path(path, resolve), mode, only_changes, counts)
+
 
+class ModeSetResult:
+    """Result of setting the modes of many objects.
 
-def set_mode_recursive(
-    path: ModePathInput, mode: ModeInputValue, dir_mode: Optional[ModeInputValue] = None
+    `modes` maps each path (as given) to its new mode and `errors` maps each
+    path that could not be set to the error raised.
+    """
+
+    __slots__ = ("modes", "errors")
+
+    def __init__(self) -> None:
+        """Create empty result."""
+        self.modes: Dict[str, ModeValue] = {}
+        self.errors: Dict[str, Exception] = {}
+
+    def __repr__(self) -> str:
+        """Return string representation."""
+        return f"ModeSetResult(modes={len(self.modes)}, errors={len(self.errors)})"
+
+    def update(self, other: "ModeSetResult") -> None:
+        """Add results of other to these results."""
+        self.modes.update(other.modes)
+        self.errors.update(other.errors)
+
+    @property
+    def ok(self) -> bool:  # pylint: disable=invalid-name
+        """Return whether every mode was set."""
+        return not self.errors
+
+
+SET_MODES_BATCH_SIZE: Final[int] = 4096
+
+
+def set_modes(
+    paths: Iterable[ModePathInput],
+    mode: ModeInputValue,
+    *,
+    workers: Optional[int] = None,
+    only_changes: bool = False,
+    counts: Optional[ModeCounts] = None,
+) -> ModeSetResult:
+    """Set bitwise mode (stat) of many unrelated objects (dirs or files).
+
+    The mode is compiled once and paths are not resolved. Paths are grouped
+    by parent directory so that each directory is opened once (where
+    directory file descriptors are supported) and every object in it is
+    set relative to it. Errors do not stop processing; they are reported
+    in the returned `ModeSetResult`.
+
+    If `workers` is greater than 1, directories are handled by a pool of
+    this many threads.
+    """
+    result = ModeSetResult()
+    for key, value in iter_set_modes(
+        paths, mode, workers=workers, only_changes=only_changes, counts=counts, batch_size=None
+    ):
+        if isinstance(value, Exception):
+            result.errors[key] = value
+        else:
+            result.modes[key] = value
+    return result
+
+
+def iter_set_modes(  # pylint: disable=too-many-arguments
+    paths: Iterable[ModePathInput],
+    mode: ModeInputValue,
+    *,
+    workers: Optional[int] = None,
+    only_changes: bool = False,
+    counts: Optional[ModeCounts] = None,
+    batch_size: Optional[int] = SET_MODES_BATCH_SIZE,
+) -> Iterator[Tuple[str, Union[ModeValue, Exception]]]:
+    """Set modes of a stream of objects, yielding each path with its new mode or error.
+
+    Like `set_modes()`, but paths are consumed `batch_size` at a time (all
+    at once if None), each batch being grouped by parent directory, and
+    results are not kept, so memory use does not grow with the number of
+    paths. Paths listed together (e.g., by `find`) share their parents.
+    """
+    spec = ModeSpec.compile(mode)
+    total = ModeCounts()
+    set_dir = functools.partial(_set_modes_in_dir, spec=spec, only_changes=only_changes)
+    executor = ThreadPoolExecutor(max_workers=workers) if workers and workers > 1 else None
+    iterator = iter(paths)
+    cwd = os.getcwd()
+    try:
+        while True:
+            groups: Dict[str, List[Tuple[str, str]]] = {}
+            taken = 0
+            for path in itertools.islice(iterator, batch_size):
+                taken += 1
+                try:
+                    key = os.fspath(path)
+                    if "\0" in key:
+                        raise ValueError(f"embedded null character in path {key!r}")
+                    # not normalized: "link/.." is the parent of the link's target
+                    parent, name = os.path.split(os.path.join(cwd, key))
+                except (TypeError, ValueError) as exc:
+                    yield str(path), exc
+                    continue
+                groups.setdefault(parent, []).append((key, name or "."))
+            if not taken:
+                break
+
+            for dir_result, dir_counts in (executor.map if executor else map)(
+                set_dir, groups.items()
+            ):
+                total += dir_counts
+                yield from dir_result.modes.items()
+                yield from dir_result.errors.items()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if counts is not None:
+            counts += total
+
+
+def _set_modes_in_dir(
+    group: Tuple[str, List[Tuple[str, str]]], spec: ModeSpec, only_changes: bool
+) -> Tuple[ModeSetResult, ModeCounts]:
+    """Set modes of objects, given by name, in one directory."""
+    parent, items = group
+    result = ModeSetResult()
+    counts = ModeCounts()
+
+    if not HAS_DIR_FD or IS_WINDOWS:
+        for key, name in items:
+            try:
+                result.modes[key] = _set_mode(
+                    ModePathInternal(os.path.join(parent, name)), spec, only_changes, counts
+                )
+            except (OSError, error) as exc:
+                result.errors[key] = exc
+        return result, counts
+
+    try:
+        dir_fd = os.open(parent, DIR_OPEN_FLAGS & ~getattr(os, "O_NOFOLLOW", 0))
+    except OSError as exc:
+        for key, _ in items:
+            result.errors[key] = exc
+        return result, counts
+
+    try:
+        for key, name in items:
+            try:
+                result.modes[key] = _set_mode_at(dir_fd, name, spec, only_changes, counts)
+            except OSError as exc:
+                result.errors[key] = exc
+    finally:
+        os.close(dir_fd)
+    return result, counts
+
+
+def set_mode_recursive(  # pylint: disable=too-many-arguments,too-many-locals,too-many-branches
+    path: ModePathInput,
+    mode: ModeInputValue,
+    dir_mode: Optional[ModeInputValue] = None,
+    walker: ModeWalker = ModeWalker.AUTO,
+    only_changes: bool = False,
+    counts: Optional[ModeCounts] = None,
+    workers: Optional[int] = None,
+    processes: Optional[int] = None,
+    include: Iterable[str] = (),
+    exclude: Iterable[str] = (),
+    max_depth: Optional[int] = None,
+    one_file_system: bool = False,
+    symlinks: Union[ModeSymlinks, str] = ModeSymlinks.FOLLOW,
 ) -> ModeValue:
     r"""Set all file and directory permissions at or under path to modes.
 
@@ -566,78 +1062,1082 @@ def set_mode_recursive(
         is set - no recursion occurs. If path is a directory, its mode and the
         mode of all files and subdirectories below it are set.
 
-    mode: (`int`)
-        Mode to be applied to object(s).
+    mode: (`int`, `str` or `ModeSpec`)
+        Mode to be applied to object(s). Strings are compiled once for the
+        whole tree rather than once per object.
 
-    dir_mode: (`int`)
+    dir_mode: (`int`, `str` or `ModeSpec`)
         If provided, this mode is given to all directories only.
 
+    walker: (`ModeWalker`)
+        Engine used to walk the tree. By default, `ModeWalker.SCANDIR` is used
+        where directory file descriptors are supported (POSIX) and
+        `ModeWalker.WALK` (`os.walk` with full paths) elsewhere.
+        With every engine, the contents of directories that cannot be
+        listed are skipped, as by `os.walk` (the directories themselves are
+        still set).
+
+    only_changes: (`bool`)
+        If True, objects already at their target mode are left untouched
+        (no chmod, so their ctime is not updated).
+
+    counts: (`ModeCounts` or `RunStats`)
+        If provided, incremented with the number of objects changed and
+        left unchanged. If a `RunStats` is given, the run is instrumented
+        (see `RunStats`), which is only done in a single thread: `workers`
+        or `processes` greater than 1 then raise `ValueError`.
+
+    workers: (`int`)
+        If greater than 1, directories are scanned and modes are set by a
+        pool of this many threads. This helps on high latency storage (e.g.,
+        NFS) where each call waits on a round trip. Directories still have
+        their mode set after everything below them.
+
+    processes: (`int`)
+        If greater than 1, the tree is split into subtrees (top-level
+        subdirectories, or deeper levels when there are too few) which are
+        handed to a pool of this many processes. Each process only returns
+        counts. Combine with `workers` to also use threads in each process.
+
+    include: (iterable of `str`)
+        If given, only objects below path whose path relative to path
+        matches one of these globs (as in `ModePolicy`, a pattern without
+        `/` matches names at any depth) have their mode set. Directories
+        are still descended into.
+
+    exclude: (iterable of `str`)
+        Objects below path matching one of these globs are left alone, and
+        matching directories are not listed at all (e.g., `.git`).
+
+    max_depth: (`int`)
+        If given, only objects at most this many levels below path are set
+        (0 sets path alone), and deeper directories are not listed.
+
+    one_file_system: (`bool`)
+        If True, directories on another device than path (mount points) are
+        left alone and not listed, like `find -xdev`.
+
+    symlinks: (`ModeSymlinks` or `str`)
+        How symbolic links below path are handled. With `FOLLOW` (default),
+        the mode of their target is set, even outside the tree. With `SKIP`
+        ("skip"), they are left alone. With `NO_FOLLOW` ("no-follow"), the
+        mode of the link itself is set where links have modes (see
+        `HAS_LCHMOD`, e.g., macOS) and they are left alone elsewhere (e.g.,
+        Linux). Links are recognized from the directory listing, so neither
+        needs a stat. Linked directories are never descended into, and path
+        itself is always followed.
+
+    Filtering (`include`, `exclude`, `max_depth`, `one_file_system` or
+    `symlinks` other than `FOLLOW`) happens during the walk, in a single
+    thread: combining it with `workers` or `processes` greater than 1
+    raises `ValueError`.
+
+    """
+    _path = _to_path(path)
+    file_spec = ModeSpec.compile(mode)
+    symlinks = _get_symlinks(symlinks)
+    walk_filter = _WalkFilter.make(
+        include, exclude, max_depth, one_file_system, _skips_symlinks(symlinks)
+    )
+    if (workers or 0) > 1 or (processes or 0) > 1:
+        if walk_filter is not None or symlinks != ModeSymlinks.FOLLOW:
+            raise ValueError(
+                "filters and symlinks handling cannot be combined with workers or processes"
+            )
+        if isinstance(counts, RunStats):
+            raise ValueError("RunStats cannot be combined with workers or processes")
+
+    if _get_object_type(_path) == ModeObjectType.FILE:
+        if isinstance(counts, RunStats):
+            return _set_mode_instrumented(None, None, _path, file_spec, only_changes, counts)
+        return _set_mode(_path, file_spec, only_changes, counts)
+
+    dir_spec = ModeSpec.compile(dir_mode) if dir_mode else file_spec
+    set_links = symlinks == ModeSymlinks.NO_FOLLOW and HAS_LCHMOD
+
+    if isinstance(counts, RunStats):
+        return _set_mode_recursive_instrumented(
+            _path,
+            file_spec,
+            dir_spec,
+            _get_walker(walker),
+            only_changes,
+            counts,
+            walk_filter,
+            set_links,
+        )
+    if walk_filter is not None or set_links:
+        use_fd = _get_walker(walker) == ModeWalker.SCANDIR
+        for handle, _, entry in _walk_tree(_path, use_fd, walk_filter):
+            if set_links and entry.is_symlink():
+                _set_link_mode(handle, entry, file_spec, only_changes, counts)
+            else:
+                _set_entry_mode(
+                    handle, entry, dir_spec if entry.is_dir() else file_spec, only_changes, counts
+                )
+    elif processes is not None and processes > 1:
+        _set_mode_recursive_sharded(
+            _path,
+            file_spec,
+            dir_spec,
+            _get_walker(walker),
+            only_changes,
+            counts,
+            processes,
+            workers,
+        )
+    elif workers is not None and workers > 1:
+        _set_mode_recursive_threaded(
+            _path, file_spec, dir_spec, _get_walker(walker), only_changes, counts, workers
+        )
+    elif _get_walker(walker) == ModeWalker.SCANDIR:
+        for dir_fd, _, entry in _scandir_walk(_path):
+            _set_entry_mode(
+                dir_fd, entry, dir_spec if entry.is_dir() else file_spec, only_changes, counts
+            )
+    else:
+        for root, dirs, files in os.walk(_path, topdown=False):
+            for one_file in files:
+                _set_mode(
+                    ModePathInternal(os.path.join(root, one_file)), file_spec, only_changes, counts
+                )
+
+            for one_dir in dirs:
+                _set_mode(
+                    ModePathInternal(os.path.join(root, one_dir)), dir_spec, only_changes, counts
+                )
+
+    return _set_mode(_path, dir_spec, only_changes, counts)
+
+
+def _set_mode_recursive_instrumented(  # pylint: disable=too-many-arguments,too-many-locals
+    path: ModePathInternal,
+    file_spec: ModeSpec,
+    dir_spec: ModeSpec,
+    walker: ModeWalker,
+    only_changes: bool,
+    stats: RunStats,
+    walk_filter: Optional["_WalkFilter"] = None,
+    set_links: bool = False,
+) -> ModeValue:
+    """Set modes below path in a single thread, recording statistics."""
+
+    def onerror(rel_path: str, exc: OSError) -> None:
+        # the directory is still set, but its contents are skipped
+        stats.errors += 1
+        if stats.on_error is not None:
+            stats.on_error(
+                os.path.join(path, rel_path.replace("/", os.sep)) if rel_path else path, exc
+            )
+
+    walk = _walk_tree(path, walker == ModeWalker.SCANDIR, walk_filter, onerror)
+    while True:
+        started = _now()
+        item = next(walk, None)
+        _add_time(stats, "walk", started)
+        if item is None:
+            break
+
+        handle, rel_dir, entry = item
+        entry_path = (
+            os.path.join(path, rel_dir.replace("/", os.sep), entry.name)
+            if isinstance(handle, int)
+            else entry.path
+        )
+        if set_links and entry.is_symlink():
+            _set_mode_instrumented(
+                handle, entry, entry_path, file_spec, only_changes, stats, follow_symlinks=False
+            )
+        elif entry.is_dir():
+            _set_mode_instrumented(handle, entry, entry_path, dir_spec, only_changes, stats)
+            if stats.on_dir_done is not None and not entry.is_symlink():
+                stats.on_dir_done(entry_path)
+        else:
+            _set_mode_instrumented(handle, entry, entry_path, file_spec, only_changes, stats)
+
+    new_mode = _set_mode_instrumented(None, None, path, dir_spec, only_changes, stats)
+    if stats.on_dir_done is not None:
+        stats.on_dir_done(path)
+    return new_mode
+
+
+def _set_mode_instrumented(  # pylint: disable=too-many-arguments
+    handle: Optional[_DirHandle],
+    entry: Optional["os.DirEntry[str]"],
+    path: str,
+    spec: ModeSpec,
+    only_changes: bool,
+    stats: RunStats,
+    follow_symlinks: bool = True,
+) -> ModeValue:
+    """Set mode of an object, by entry relative to an fd handle if given, recording statistics."""
+    stats.visited += 1
+    stats.path_bytes += len(path)
+    current_mode = new_mode = spec.set_mask
+    try:
+        if spec.is_symbolic or only_changes or stats.on_entry is not None:
+            started = _now()
+            stats.stats += 1
+            if (isinstance(handle, int) or not follow_symlinks) and entry is not None:
+                current_mode = entry.stat(follow_symlinks=follow_symlinks).st_mode & (
+                    stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO
+                )
+            else:
+                current_mode = _get_mode(ModePathInternal(path))
+            new_mode = spec.apply(current_mode)
+            _add_time(stats, "compute", started)
+            if only_changes and new_mode == current_mode:
+                stats.unchanged += 1
+                if stats.on_entry is not None:
+                    stats.on_entry(path, current_mode, new_mode)
+                return new_mode
+
+        started = _now()
+        if isinstance(handle, int) and entry is not None:
+            os.chmod(entry.name, new_mode, dir_fd=handle, follow_symlinks=follow_symlinks)
+        elif not follow_symlinks:
+            os.chmod(path, new_mode, follow_symlinks=False)
+        elif IS_WINDOWS:
+            _win_set_permissions(
+                ModePathInternal(path), new_mode, _get_object_type(ModePathInternal(path))
+            )
+        else:
+            os.chmod(path, new_mode)
+        _add_time(stats, "apply", started)
+    except (OSError, error) as exc:
+        stats.errors += 1
+        if stats.on_error is None:
+            raise
+        stats.on_error(path, exc)
+        return new_mode
+
+    stats.changed += 1
+    if stats.on_entry is not None:
+        stats.on_entry(path, current_mode, new_mode)
+    return new_mode
+
+
+class ModePlanEntry(NamedTuple):
+    """Mode an object has and the mode it would be given."""
+
+    path: str
+    old: ModeValue
+    new: ModeValue
+
+    @property
+    def changed(self) -> bool:
+        """Return whether the mode would change."""
+        return self.old != self.new
+
+
+def plan_mode_recursive(  # pylint: disable=too-many-arguments
+    path: ModePathInput,
+    mode: ModeInputValue,
+    dir_mode: Optional[ModeInputValue] = None,
+    walker: ModeWalker = ModeWalker.AUTO,
+    counts: Optional[ModeCounts] = None,
+    onerror: Optional[Callable[[OSError], None]] = None,
+    include: Iterable[str] = (),
+    exclude: Iterable[str] = (),
+    max_depth: Optional[int] = None,
+    one_file_system: bool = False,
+    symlinks: Union[ModeSymlinks, str] = ModeSymlinks.FOLLOW,
+) -> Iterator[ModePlanEntry]:
+    """Plan `set_mode_recursive()` without changing anything.
+
+    Yields, in the order they would be set (path last), each object with its
+    current mode and the mode it would be given. The tree is walked by the
+    same engine as `set_mode_recursive()` (see `walker`), but nothing is
+    written, and the current mode of every object is read (which the real
+    run skips for octal modes unless `only_changes` is True), so the cost
+    of a plan is an upper bound of the cost of reading the tree in the run.
+
+    If given, `counts` is incremented with the number of objects that would
+    be changed and left unchanged. Errors reading a mode are passed to
+    `onerror` if given, else raised. Directories that cannot be listed are
+    skipped as in `set_mode_recursive()`, after being passed to `onerror`.
+    `include`, `exclude`, `max_depth`, `one_file_system` and `symlinks`
+    filter the tree as in `set_mode_recursive()`.
     """
     _path = _to_path(path)
+    file_spec = ModeSpec.compile(mode)
+    total = ModeCounts()
+    try:
+        if _get_object_type(_path) == ModeObjectType.FILE:
+            yield from _plan_mode(None, None, _path, file_spec, total, onerror)
+            return
+
+        dir_spec = ModeSpec.compile(dir_mode) if dir_mode else file_spec
+        use_fd = _get_walker(walker) == ModeWalker.SCANDIR
+        symlinks = _get_symlinks(symlinks)
+        walk_filter = _WalkFilter.make(
+            include, exclude, max_depth, one_file_system, _skips_symlinks(symlinks)
+        )
+        set_links = symlinks == ModeSymlinks.NO_FOLLOW and HAS_LCHMOD
+        walk = _walk_tree(
+            _path, use_fd, walk_filter, (lambda _, exc: onerror(exc)) if onerror else None
+        )
+        for handle, rel_dir, entry in walk:
+            entry_path = (
+                os.path.join(_path, rel_dir.replace("/", os.sep), entry.name)
+                if isinstance(handle, int)
+                else entry.path
+            )
+            if set_links and entry.is_symlink():
+                yield from _plan_mode(
+                    handle, entry, entry_path, file_spec, total, onerror, follow_symlinks=False
+                )
+            else:
+                spec = dir_spec if entry.is_dir() else file_spec
+                yield from _plan_mode(handle, entry, entry_path, spec, total, onerror)
+        yield from _plan_mode(None, None, _path, dir_spec, total, onerror)
+    finally:
+        if counts is not None:
+            counts += total
+
+
+def _plan_mode(  # pylint: disable=too-many-arguments
+    handle: Optional[_DirHandle],
+    entry: Optional["os.DirEntry[str]"],
+    path: str,
+    spec: ModeSpec,
+    counts: ModeCounts,
+    onerror: Optional[Callable[[OSError], None]],
+    follow_symlinks: bool = True,
+) -> Iterator[ModePlanEntry]:
+    """Plan the mode of an object, by entry relative to an fd handle if given."""
+    try:
+        if (isinstance(handle, int) or not follow_symlinks) and entry is not None:
+            old_mode = entry.stat(follow_symlinks=follow_symlinks).st_mode & (
+                stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO
+            )
+        else:
+            old_mode = _get_mode(ModePathInternal(path))
+    except OSError as exc:
+        if onerror is None:
+            raise
+        onerror(exc)
+        return
+
+    planned = ModePlanEntry(path, old_mode, spec.apply(old_mode))
+    if planned.changed:
+        counts.changed += 1
+    else:
+        counts.unchanged += 1
+    yield planned
+
+
+STATE_RACY_NS: Final[int] = 2_000_000_000
+STATE_SCHEMA: Final[str] = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    dev INTEGER,
+    ino INTEGER,
+    mtime_ns INTEGER,
+    ctime_ns INTEGER,
+    spec TEXT,
+    subdirs TEXT
+)
+"""
+
+
+def set_mode_incremental(  # pylint: disable=too-many-arguments
+    path: ModePathInput,
+    mode: ModeInputValue,
+    state_file: ModePathInput,
+    dir_mode: Optional[ModeInputValue] = None,
+    full: bool = False,
+    only_changes: bool = False,
+    counts: Optional[ModeCounts] = None,
+) -> ModeCounts:
+    """Set modes at or under a directory, skipping directories unchanged since the last run.
+
+    After a directory and everything in it are set, its path, device, inode,
+    mtime, ctime, the modes applied and the names of its subdirectories are
+    recorded in `state_file` (an SQLite database, created if missing, which
+    can be shared by several trees).
+    On the next run, a directory whose metadata and modes match its record
+    has not had entries added, removed or renamed, nor its mode changed, so
+    it is not listed and the modes of its files are not set again; its
+    recorded subdirectories are still checked one by one. An unchanged tree
+    thus costs one stat per directory.
+
+    Changes to the modes of files themselves do not update their directory,
+    so they are only undone by a full pass, made if `full` is True (or when
+    modes differ from the recorded ones). Symbolic links are handled as by
+    `set_mode_recursive()`.
+
+    Returns counts of objects changed and unchanged (objects skipped with
+    their directory are not counted), which are also added to `counts`.
+    If `counts` is a `RunStats`, objects set are recorded by it instead.
+    """
+    _path = _to_path(path)
+    file_spec = ModeSpec.compile(mode)
+    dir_spec = ModeSpec.compile(dir_mode) if dir_mode else file_spec
+    stats = counts if isinstance(counts, RunStats) else None
+    total = ModeCounts()
+
+    def set_one(one_path: str, spec: ModeSpec) -> None:
+        if stats is not None:
+            _set_mode_instrumented(None, None, one_path, spec, only_changes, stats)
+        else:
+            _set_mode(ModePathInternal(one_path), spec, only_changes, total)
 
     if _get_object_type(_path) == ModeObjectType.FILE:
-        return _set_mode(_path, mode)
+        set_one(_path, file_spec)
+    else:
+        spec_key = (
+            f"{file_spec.clear_mask:o}:{file_spec.set_mask:o}/"
+            f"{dir_spec.clear_mask:o}:{dir_spec.set_mask:o}"
+        )
+        with contextlib.closing(sqlite3.connect(os.fspath(state_file))) as connection:
+            connection.execute(STATE_SCHEMA)
+            try:
+                _set_mode_incremental_walk(
+                    connection, _path, file_spec, dir_spec, spec_key, full, set_one
+                )
+            finally:
+                # directories are recorded once done, so an interrupted run keeps its progress
+                connection.commit()
+
+    if stats is not None:
+        return stats
+    if counts is not None:
+        counts += total
+    return total
+
+
+_IncrementalFrame = Tuple[str, List[str], Iterator[str], Optional[List[str]]]
+
+
+def _set_mode_incremental_walk(  # pylint: disable=too-many-arguments
+    connection: sqlite3.Connection,
+    path: str,
+    file_spec: ModeSpec,
+    dir_spec: ModeSpec,
+    spec_key: str,
+    full: bool,
+    set_one: Callable[[str, ModeSpec], None],
+) -> None:
+    """Walk below path bottom-up, listing and setting only changed directories."""
+    # frames: path, recorded subdirectories, subdirectories left to visit and current
+    # subdirectories (None if the directory is unchanged)
+    stack: List[_IncrementalFrame] = []
+
+    def enter(dir_path: str) -> None:
+        dir_stat = os.stat(dir_path)
+        row = connection.execute(
+            "SELECT dev, ino, mtime_ns, ctime_ns, spec, subdirs FROM dirs WHERE path = ?",
+            (dir_path,),
+        ).fetchone()
+        recorded = row[5].split("\0") if row and row[5] else []
+        current = (
+            dir_stat.st_dev,
+            dir_stat.st_ino,
+            dir_stat.st_mtime_ns,
+            dir_stat.st_ctime_ns,
+            spec_key,
+        )
+        if not full and row is not None and tuple(row[:5]) == current:
+            stack.append((dir_path, recorded, iter(recorded), None))
+            return
+
+        subdirs: List[str] = []
+        for entry in _list_dir(dir_path):
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.name)
+            else:
+                set_one(entry.path, dir_spec if entry.is_dir() else file_spec)
+        stack.append((dir_path, recorded, iter(subdirs), subdirs))
+
+    enter(path)
+    while stack:
+        dir_path, recorded, pending, subdirs = stack[-1]
+        name = next(pending, None)
+        if name is not None:
+            enter(os.path.join(dir_path, name))
+            continue
+
+        stack.pop()
+        if subdirs is None:
+            continue
+        set_one(dir_path, dir_spec)
+        dir_stat = os.stat(dir_path)
+        # an entry added within the same mtime tick would go unnoticed, so recent
+        # directories are recorded as changed (but their subdirectories are kept)
+        mtime_ns = dir_stat.st_mtime_ns
+        if time.time_ns() - mtime_ns < STATE_RACY_NS:
+            mtime_ns = -1
+        for removed in set(recorded) - set(subdirs):
+            prefix = os.path.join(dir_path, removed)
+            connection.execute(
+                "DELETE FROM dirs WHERE path = ? OR (path >= ? AND path < ?)",
+                (prefix, prefix + os.sep, prefix + chr(ord(os.sep) + 1)),
+            )
+        connection.execute(
+            "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                dir_path,
+                dir_stat.st_dev,
+                dir_stat.st_ino,
+                mtime_ns,
+                dir_stat.st_ctime_ns,
+                spec_key,
+                "\0".join(subdirs),
+            ),
+        )
+
+
+def _set_mode_recursive_threaded(  # pylint: disable=too-many-arguments,too-many-locals
+    path: ModePathInternal,
+    file_spec: ModeSpec,
+    dir_spec: ModeSpec,
+    walker: ModeWalker,
+    only_changes: bool,
+    counts: Optional[ModeCounts],
+    workers: int,
+) -> None:
+    """Set modes below path using a pool of threads.
+
+    Directories are scanned (and their files' modes set) as soon as they are
+    found. Once the whole tree is scanned, directory modes are set deepest
+    level first so that a directory is always changed after its children.
+    """
+    total = ModeCounts()
+    depths: List[List[ModePathInternal]] = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        future = executor.submit(_set_mode_dir_files, path, file_spec, walker, only_changes)
+        depth_of: Dict["Future[_DirFilesResult]", int] = {future: 0}
+        pending: Set["Future[_DirFilesResult]"] = {future}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                depth = depth_of.pop(future)
+                subdirs, dir_counts = future.result()
+                total += dir_counts
+                if subdirs and len(depths) <= depth:
+                    depths.append([])
+                for subdir, is_link in subdirs:
+                    depths[depth].append(subdir)
+                    if not is_link:
+                        child = executor.submit(
+                            _set_mode_dir_files, subdir, file_spec, walker, only_changes
+                        )
+                        pending.add(child)
+                        depth_of[child] = depth + 1
+
+        for level in reversed(depths):
+            for dir_counts in executor.map(
+                functools.partial(_set_mode_counted, spec=dir_spec, only_changes=only_changes),
+                level,
+            ):
+                total += dir_counts
+
+    if counts is not None:
+        counts += total
+
+
+SHARDS_PER_PROCESS: Final[int] = 4
+SHARD_MAX_DEPTH: Final[int] = 3
+
+
+def _set_mode_recursive_sharded(  # pylint: disable=too-many-arguments,too-many-locals
+    path: ModePathInternal,
+    file_spec: ModeSpec,
+    dir_spec: ModeSpec,
+    walker: ModeWalker,
+    only_changes: bool,
+    counts: Optional[ModeCounts],
+    processes: int,
+    workers: Optional[int],
+) -> None:
+    """Set modes below path by handing subtrees to a pool of processes.
+
+    The top levels are expanded here (setting modes of files found along the
+    way) until there are enough subtrees to keep every process busy. Each
+    subtree is then set in a worker process. Finally, the expanded
+    directories are set here, deepest level first.
+    """
+    total = ModeCounts()
+    depths: List[List[ModePathInternal]] = []
+    level = [path]
+    while level and len(depths) < SHARD_MAX_DEPTH and len(level) < processes * SHARDS_PER_PROCESS:
+        depths.append(level)
+        next_level: List[ModePathInternal] = []
+        for one_dir in level:
+            subdirs, dir_counts = _set_mode_dir_files(one_dir, file_spec, walker, only_changes)
+            total += dir_counts
+            for subdir, is_link in subdirs:
+                if is_link:
+                    _set_mode(subdir, dir_spec, only_changes, total)
+                else:
+                    next_level.append(subdir)
+        level = next_level
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for shard_counts in executor.map(
+            functools.partial(
+                _set_mode_shard,
+                file_spec=file_spec,
+                dir_spec=dir_spec,
+                walker=walker,
+                only_changes=only_changes,
+                workers=workers,
+            ),
+            level,
+        ):
+            total += shard_counts
+
+    # the top directory itself is set by the caller
+    for expanded in reversed(depths[1:]):
+        for one_dir in expanded:
+            _set_mode(one_dir, dir_spec, only_changes, total)
+
+    if counts is not None:
+        counts += total
+
+
+def _set_mode_shard(  # pylint: disable=too-many-arguments
+    path: ModePathInternal,
+    file_spec: ModeSpec,
+    dir_spec: ModeSpec,
+    walker: ModeWalker,
+    only_changes: bool,
+    workers: Optional[int],
+) -> ModeCounts:
+    """Set modes of a subtree in a worker process, returning only counts."""
+    counts = ModeCounts()
+    set_mode_recursive(
+        path,
+        file_spec,
+        dir_spec,
+        walker=walker,
+        only_changes=only_changes,
+        counts=counts,
+        workers=workers,
+    )
+    return counts
 
-    if not dir_mode:
-        dir_mode = mode
 
-    for root, dirs, files in os.walk(_path, topdown=False):
-        for one_file in files:
-            _set_mode(ModePathInternal(os.path.join(root, one_file)), mode)
+_DirFilesResult = Tuple[List[Tuple[ModePathInternal, bool]], ModeCounts]
 
-        for one_dir in dirs:
-            _set_mode(ModePathInternal(os.path.join(root, one_dir)), dir_mode)
 
-    return _set_mode(_path, dir_mode)
+def _set_mode_dir_files(
+    path: ModePathInternal, file_spec: ModeSpec, walker: ModeWalker, only_changes: bool
+) -> _DirFilesResult:
+    """Set modes of files directly in a directory.
 
+    Returns the subdirectories found (and whether each is a symbolic link,
+    which is not descended into) along with counts of files visited. A
+    directory that cannot be opened or listed has nothing found, as in
+    `os.walk()`.
+    """
+    counts = ModeCounts()
+    subdirs: List[Tuple[ModePathInternal, bool]] = []
+    if walker == ModeWalker.SCANDIR:
+        try:
+            dir_fd = os.open(path, DIR_OPEN_FLAGS)
+        except OSError:
+            return subdirs, counts
+        try:
+            for entry in _list_dir_or_skip(dir_fd):
+                if entry.is_dir():
+                    subdirs.append(
+                        (ModePathInternal(os.path.join(path, entry.name)), entry.is_symlink())
+                    )
+                else:
+                    _set_mode_at(dir_fd, entry, file_spec, only_changes, counts)
+        finally:
+            os.close(dir_fd)
+    else:
+        for entry in _list_dir_or_skip(path):
+            if entry.is_dir():
+                subdirs.append((ModePathInternal(entry.path), entry.is_symlink()))
+            else:
+                _set_mode(ModePathInternal(entry.path), file_spec, only_changes, counts)
+    return subdirs, counts
+
+
+def _set_mode_counted(path: ModePathInternal, spec: ModeSpec, only_changes: bool) -> ModeCounts:
+    """Set mode of object, returning counts for this object alone."""
+    counts = ModeCounts()
+    _set_mode(path, spec, only_changes, counts)
+    return counts
+
+
+def _get_walker(walker: ModeWalker) -> ModeWalker:
+    """Get the walker engine to use on this platform."""
+    if walker == ModeWalker.AUTO:
+        return ModeWalker.SCANDIR if HAS_DIR_FD and not IS_WINDOWS else ModeWalker.WALK
+
+    if walker == ModeWalker.SCANDIR and not HAS_DIR_FD:
+        raise NotImplementedError("scandir walker requires directory file descriptor support")
+
+    return walker
+
+
+# directory handle, path relative to the top, entries left and the directory's own entry
+_WalkFrame = Tuple[_DirHandle, str, Iterator["os.DirEntry[str]"], Optional["os.DirEntry[str]"]]
+
+
+def _scandir_walk(  # pylint: disable=too-many-branches
+    path: ModePathInternal,
+    use_fd: bool = True,
+    descend: Optional[Callable[[str, "os.DirEntry[str]"], bool]] = None,
+    onerror: Optional[Callable[[str, OSError], None]] = None,
+) -> Iterator[Tuple[_DirHandle, str, "os.DirEntry[str]"]]:
+    """Walk bottom-up below path, yielding entries with their parent directory.
+
+    Each entry is yielded with the handle of its parent directory (an open
+    fd if use_fd is True, else its path) and the parent's path relative to
+    path, with "/" separators ("" for path itself).
+
+    Directories are yielded after their contents and symbolic links to
+    directories are not descended into, matching `os.walk(topdown=False)`.
+    If given, `descend(rel_path, entry)` is called for each directory and
+    its contents are skipped when it returns False. With fds, only one
+    descriptor per level is held open, so entries are always addressed by
+    name relative to their parent and never by full path.
+
+    Errors opening or listing a directory skip its contents (the directory
+    itself is still yielded), as `os.walk()` does, after being passed to
+    `onerror(rel_path, exc)` if given.
+    """
+    stack: List[_WalkFrame] = []
+    try:
+        top: _DirHandle = os.open(path, DIR_OPEN_FLAGS) if use_fd else path
+    except OSError as exc:
+        if onerror is not None:
+            onerror("", exc)
+        return
+    stack.append((top, "", iter([]), None))
+    try:
+        try:
+            stack[0] = (top, "", iter(_list_dir(top)), None)
+        except OSError as exc:
+            if onerror is not None:
+                onerror("", exc)
+        while stack:
+            handle, rel_dir, entries, dir_entry = stack[-1]
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                    if (descend is None or descend(rel_path, entry)) and _enter_dir(
+                        stack, handle, rel_path, entry, use_fd, onerror
+                    ):
+                        break
+                yield handle, rel_dir, entry
+            else:
+                stack.pop()
+                if use_fd:
+                    os.close(handle)  # type: ignore[arg-type]
+                if dir_entry is not None:
+                    yield stack[-1][0], stack[-1][1], dir_entry
+    finally:
+        if use_fd:
+            for handle, _, _, _ in stack:
+                os.close(handle)  # type: ignore[arg-type]
+
+
+def _enter_dir(  # pylint: disable=too-many-arguments
+    stack: List[_WalkFrame],
+    handle: _DirHandle,
+    rel_path: str,
+    entry: "os.DirEntry[str]",
+    use_fd: bool,
+    onerror: Optional[Callable[[str, OSError], None]],
+) -> bool:
+    """Open and list a directory onto the stack of `_scandir_walk()`, returning whether it was."""
+    try:
+        child: _DirHandle = (
+            os.open(entry.name, DIR_OPEN_FLAGS, dir_fd=handle)  # type: ignore[arg-type]
+            if use_fd
+            else entry.path
+        )
+        # push before listing so the fd is closed if listing fails
+        stack.append((child, rel_path, iter([]), entry))
+        stack[-1] = (child, rel_path, iter(_list_dir(child)), entry)
+    except OSError as exc:
+        if stack and stack[-1][3] is entry:
+            stack.pop()
+            if use_fd:
+                os.close(child)  # type: ignore[arg-type]
+        if onerror is not None:
+            onerror(rel_path, exc)
+        return False
+    return True
+
+
+def _list_dir(handle: _DirHandle) -> List["os.DirEntry[str]"]:
+    """List entries of a directory given by fd or path."""
+    with os.scandir(handle) as entries:  # type: ignore[type-var]
+        return list(entries)
+
+
+def _list_dir_or_skip(handle: _DirHandle) -> List["os.DirEntry[str]"]:
+    """List entries of a directory given by fd or path, or none if it cannot be listed."""
+    try:
+        return _list_dir(handle)
+    except OSError:
+        return []
+
+
+class _WalkFilter:
+    """Parts of a tree left alone by a recursive walk."""
+
+    __slots__ = ("include", "exclude", "max_depth", "one_file_system", "skip_symlinks")
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        include: Iterable[str],
+        exclude: Iterable[str],
+        max_depth: Optional[int],
+        one_file_system: bool,
+        skip_symlinks: bool,
+    ) -> None:
+        """Compile glob patterns."""
+        self.include = _compile_globs(include)
+        self.exclude = _compile_globs(exclude)
+        self.max_depth = max_depth
+        self.one_file_system = one_file_system
+        self.skip_symlinks = skip_symlinks
+
+    def __repr__(self) -> str:
+        """Return string representation."""
+        return (
+            f"_WalkFilter(include={self.include!r}, exclude={self.exclude!r}, "
+            f"max_depth={self.max_depth!r}, one_file_system={self.one_file_system!r}, "
+            f"skip_symlinks={self.skip_symlinks!r})"
+        )
+
+    @classmethod
+    def make(  # pylint: disable=too-many-arguments
+        cls,
+        include: Iterable[str] = (),
+        exclude: Iterable[str] = (),
+        max_depth: Optional[int] = None,
+        one_file_system: bool = False,
+        skip_symlinks: bool = False,
+    ) -> Optional["_WalkFilter"]:
+        """Get a filter, or None if nothing is filtered."""
+        include, exclude = list(include), list(exclude)
+        if include or exclude or max_depth is not None or one_file_system or skip_symlinks:
+            return cls(include, exclude, max_depth, one_file_system, skip_symlinks)
+        return None
+
+
+def _get_symlinks(symlinks: Union[ModeSymlinks, str]) -> ModeSymlinks:
+    """Get handling of symbolic links from an enum or its name (e.g., "no-follow")."""
+    if isinstance(symlinks, ModeSymlinks):
+        return symlinks
+    try:
+        return ModeSymlinks[symlinks.upper().replace("-", "_")]
+    except KeyError:
+        raise ValueError(f"unknown handling of symbolic links: {symlinks!r}") from None
+
+
+def _skips_symlinks(symlinks: ModeSymlinks) -> bool:
+    """Get whether symbolic links are left out of a walk (links have no mode without lchmod)."""
+    return symlinks == ModeSymlinks.SKIP or (symlinks == ModeSymlinks.NO_FOLLOW and not HAS_LCHMOD)
+
+
+def _compile_globs(patterns: Iterable[str]) -> Optional["re.Pattern[str]"]:
+    """Combine path globs into one expression, or None if there are none."""
+    expressions = [_glob_to_regex(pattern) for pattern in patterns]
+    if not expressions:
+        return None
+    return re.compile("(?:" + "|".join(expressions) + r")\Z")
+
+
+def _walk_tree(
+    path: ModePathInternal,
+    use_fd: bool = True,
+    walk_filter: Optional[_WalkFilter] = None,
+    onerror: Optional[Callable[[str, OSError], None]] = None,
+) -> Iterator[Tuple[_DirHandle, str, "os.DirEntry[str]"]]:
+    """Walk bottom-up below path like `_scandir_walk()`, leaving out filtered entries.
+
+    Directories matching an exclude pattern, or on another device than path
+    with `one_file_system`, are neither listed nor yielded. Directories at
+    `max_depth` are yielded but not listed. Entries not matching an include
+    pattern are not yielded, but directories are still descended into.
+    Symbolic links are not yielded with `skip_symlinks`. Errors opening or
+    listing directories are handled as by `_scandir_walk()`.
+    """
+    if walk_filter is None:
+        yield from _scandir_walk(path, use_fd, onerror=onerror)
+        return
 
-def _get_effective_mode_multiple(current_mode: ModeValue, modes: ModeInputValue) -> ModeValue:
-    """Get octal mode, given current mode and symbolic mode modifiers."""
-    new_mode = current_mode
-    for mode in str(modes).split(","):
-        new_mode = get_effective_mode(new_mode, mode)
+    max_depth = walk_filter.max_depth
+    if max_depth is not None and max_depth < 1:
+        return
+    exclude, include = walk_filter.exclude, walk_filter.include
+    skip_symlinks = walk_filter.skip_symlinks
+    device = os.stat(path).st_dev if walk_filter.one_file_system else None
+    # directories pruned by descend(), which are yielded right after the call
+    pruned: Set[str] = set()
+
+    def descend(rel_path: str, entry: "os.DirEntry[str]") -> bool:
+        if (exclude is not None and exclude.match(rel_path)) or (
+            device is not None and entry.stat(follow_symlinks=False).st_dev != device
+        ):
+            pruned.add(rel_path)
+            return False
+        return max_depth is None or rel_path.count("/") + 1 < max_depth
+
+    for handle, rel_dir, entry in _scandir_walk(path, use_fd, descend, onerror):
+        if skip_symlinks and entry.is_symlink():
+            continue
+        rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+        if rel_path in pruned:
+            pruned.discard(rel_path)
+        elif (exclude is None or not exclude.match(rel_path)) and (
+            include is None or include.match(rel_path)
+        ):
+            yield handle, rel_dir, entry
+
+
+def _set_entry_mode(
+    handle: _DirHandle,
+    entry: "os.DirEntry[str]",
+    spec: ModeSpec,
+    only_changes: bool = False,
+    counts: Optional[ModeCounts] = None,
+) -> ModeValue:
+    """Set bitwise mode (stat) of a directory entry yielded by `_scandir_walk()`."""
+    if isinstance(handle, int):
+        return _set_mode_at(handle, entry, spec, only_changes, counts)
+    return _set_mode(ModePathInternal(entry.path), spec, only_changes, counts)
+
+
+def _set_mode_at(
+    dir_fd: int,
+    entry: Union["os.DirEntry[str]", str],
+    spec: ModeSpec,
+    only_changes: bool = False,
+    counts: Optional[ModeCounts] = None,
+) -> ModeValue:
+    """Set bitwise mode (stat) of a directory entry (or name) relative to its parent fd."""
+    if spec.is_symbolic or only_changes:
+        if isinstance(entry, str):
+            stat_result = os.stat(entry, dir_fd=dir_fd)
+        else:
+            stat_result = entry.stat()
+        current_mode = stat_result.st_mode & (stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
+        new_mode = spec.apply(current_mode)
+        if only_changes and new_mode == current_mode:
+            if counts is not None:
+                counts.unchanged += 1
+            return new_mode
+    else:
+        new_mode = spec.set_mask
+
+    os.chmod(entry if isinstance(entry, str) else entry.name, new_mode, dir_fd=dir_fd)
+
+    if counts is not None:
+        counts.changed += 1
+    return new_mode
+
+
+def _set_link_mode(
+    handle: _DirHandle,
+    entry: "os.DirEntry[str]",
+    spec: ModeSpec,
+    only_changes: bool = False,
+    counts: Optional[ModeCounts] = None,
+) -> ModeValue:
+    """Set bitwise mode of a symbolic link itself, where supported (see `HAS_LCHMOD`)."""
+    if spec.is_symbolic or only_changes:
+        stat_result = entry.stat(follow_symlinks=False)
+        current_mode = stat_result.st_mode & (stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
+        new_mode = spec.apply(current_mode)
+        if only_changes and new_mode == current_mode:
+            if counts is not None:
+                counts.unchanged += 1
+            return new_mode
+    else:
+        new_mode = spec.set_mask
+
+    if isinstance(handle, int):
+        os.chmod(entry.name, new_mode, dir_fd=handle, follow_symlinks=False)
+    else:
+        os.chmod(entry.path, new_mode, follow_symlinks=False)
+
+    if counts is not None:
+        counts.changed += 1
     return new_mode
 
 
 def get_effective_mode(current_mode: ModeValue, symbolic: ModeInputValue) -> ModeValue:
     """Get octal mode, given current mode and symbolic mode modifier."""
+    if isinstance(symbolic, ModeSpec):
+        return symbolic.apply(current_mode)
+
     if not isinstance(symbolic, str):
         raise AttributeError("symbolic must be a string")
 
-    if "," in symbolic:
-        return _get_effective_mode_multiple(current_mode, symbolic)
-
-    result = re.search(r"^\s*([ugoa]*)([-+=])([rwx]*)\s*$", symbolic)
-    if result is None:
+    if "+" not in symbolic and "-" not in symbolic and "=" not in symbolic:
         raise AttributeError("bad format of symbolic representation modifier")
 
-    whom = str(result.group(1)) or "ugo"
-    operation = str(result.group(2))
-    perm = str(result.group(3))
+    return ModeSpec.compile(symbolic).apply(current_mode)
 
-    if "a" in whom:
-        whom = "ugo"
 
-    # bitwise magic
-    bit_perm = _get_basic_symbol_to_mode(perm)
-    mask_mode = (
-        (bit_perm << 6 if "u" in whom else 0)
-        | (bit_perm << 3 if "g" in whom else 0)
-        | (bit_perm << 0 if "o" in whom else 0)
-    )
+ModesInput = Union["numpy.ndarray[Any, Any]", "array.array[int]", Iterable[int]]
 
-    if operation == "=":
-        original = (
-            (current_mode & 448 if "u" not in whom else 0)
-            | (current_mode & 56 if "g" not in whom else 0)
-            | (current_mode & 7 if "o" not in whom else 0)
+
+def get_effective_modes(current_modes: ModesInput, mode: ModeInputValue) -> ModesInput:
+    """Get new modes of many objects at once, given their current modes.
+
+    `mode` is compiled once and applied to every current mode with mask
+    operations. A NumPy array gives an array of the same type, computed
+    without a Python loop. An `array.array` (e.g., of type "H", as used
+    for modes in manifests) gives an array of the same type, also
+    vectorized if NumPy is installed. Any other iterable gives a list.
+    """
+    spec = ModeSpec.compile(mode)
+    numpy_module = _import_numpy() if isinstance(current_modes, array.array) else None
+    if numpy_module is None:
+        # a NumPy array can only be given once NumPy is imported
+        numpy_module = sys.modules.get("numpy")
+    if numpy_module is not None:
+        if isinstance(current_modes, numpy_module.ndarray):
+            return _get_effective_modes_numpy(current_modes, spec)
+        if isinstance(current_modes, array.array):
+            result = array.array(current_modes.typecode)
+            result.frombytes(
+                _get_effective_modes_numpy(
+                    numpy_module.frombuffer(current_modes, current_modes.typecode), spec
+                ).tobytes()
+            )
+            return result
+
+    keep = ~spec.clear_mask
+    set_mask = spec.set_mask
+    if isinstance(current_modes, array.array):
+        return array.array(
+            current_modes.typecode, [(one & keep) | set_mask for one in current_modes]
         )
-        return mask_mode | original
+    return [(one & keep) | set_mask for one in current_modes]
+
+
+@functools.lru_cache(maxsize=None)
+def _import_numpy() -> Any:
+    """Import NumPy on first use, giving None if it is not installed."""
+    try:
+        import numpy as numpy_module  # pylint: disable=import-error,import-outside-toplevel
+    except ImportError:
+        return None
+    return numpy_module
 
-    if operation == "+":
-        return current_mode | mask_mode
 
-    return current_mode & ~mask_mode
+def _get_effective_modes_numpy(
+    current_modes: "numpy.ndarray[Any, Any]", spec: ModeSpec
+) -> "numpy.ndarray[Any, Any]":
+    """Apply a mode to a NumPy array of modes, keeping its type."""
+    # masks are limited to the range of the type, so no negative constants are needed
+    limit = int(_import_numpy().iinfo(current_modes.dtype).max)
+    cleared = current_modes ^ (current_modes & (spec.clear_mask & limit))
+    return cleared | (spec.set_mask & limit)
 
 
 def _get_object_type(path: ModePathInternal) -> ModeObjectType:
@@ -650,12 +2150,774 @@ def get_object_type(path: ModePathInput) -> ModeObjectType:
     return _get_object_type(_to_path(path))
 
 
+class ModeRule(NamedTuple):
+    """Rule giving the mode of objects whose relative path matches a pattern.
+
+    `pattern` is a glob, or a regular expression if `regex` is True, matched
+    against the whole path relative to the root with "/" separators. In
+    globs, `*` and `?` do not match "/" while `**` matches any number of
+    directories, and a glob without "/" matches the name at any depth
+    (e.g., "*.sh"). If `object_type` is given, the rule only applies to
+    that type of object.
+    """
+
+    pattern: str
+    mode: ModeInputValue
+    object_type: Optional[ModeObjectType] = None
+    regex: bool = False
+
+
+class ModePolicy:
+    """Rules mapping path patterns to modes, compiled into single matchers.
+
+    The rules applying to files and those applying to directories are each
+    combined into one regular expression, so an object is matched with a
+    single call however many rules there are. If `first_match` is True the
+    first matching rule wins, otherwise the last one does.
+    """
+
+    def __init__(
+        self, rules: Iterable[Union[ModeRule, Tuple[Any, ...]]], first_match: bool = True
+    ) -> None:
+        """Compile rules."""
+        self.rules: List[ModeRule] = [
+            rule if isinstance(rule, ModeRule) else ModeRule(*rule) for rule in rules
+        ]
+        self.first_match = first_match
+        ordered = self.rules if first_match else self.rules[::-1]
+        self._file_matcher = _compile_rules(
+            rule for rule in ordered if rule.object_type in (None, ModeObjectType.FILE)
+        )
+        self._dir_matcher = _compile_rules(
+            rule for rule in ordered if rule.object_type in (None, ModeObjectType.DIRECTORY)
+        )
+        self._prefixes: Optional[List[Tuple[str, ...]]] = []
+        for rule in self.rules:
+            prefix = _get_rule_prefix(rule)
+            if prefix is None:
+                self._prefixes = None
+                break
+            self._prefixes.append(prefix)
+
+    def __repr__(self) -> str:
+        """Return string representation."""
+        return f"ModePolicy({self.rules!r}, first_match={self.first_match!r})"
+
+    @staticmethod
+    def load(path: ModePathInput, first_match: bool = True) -> "ModePolicy":
+        """Load rules from a policy file.
+
+        Each line holds a pattern, a mode and optionally "file" or "dir" to
+        restrict the object type, separated by whitespace. Patterns starting
+        with "re:" are regular expressions. Blank lines and lines starting
+        with "#" are ignored.
+        """
+        rules: List[ModeRule] = []
+        with open(path, encoding="utf-8") as policy_file:
+            for number, line in enumerate(policy_file, 1):
+                fields = line.split()
+                if not fields or fields[0].startswith("#"):
+                    continue
+                if len(fields) not in (2, 3) or (
+                    len(fields) == 3 and fields[2] not in POLICY_OBJECT_TYPES
+                ):
+                    raise ValueError(f"{path}:{number}: expected 'PATTERN MODE [file|dir]'")
+                pattern, mode = fields[0], fields[1]
+                regex = pattern.startswith("re:")
+                rules.append(
+                    ModeRule(
+                        pattern[3:] if regex else pattern,
+                        ModeSpec.compile(mode),
+                        POLICY_OBJECT_TYPES[fields[2]] if len(fields) == 3 else None,
+                        regex,
+                    )
+                )
+        return ModePolicy(rules, first_match)
+
+    def match(self, rel_path: str, object_type: ModeObjectType) -> Optional[ModeSpec]:
+        """Get mode of the rule matching a relative path, if any."""
+        matcher, specs = (
+            self._dir_matcher if object_type == ModeObjectType.DIRECTORY else self._file_matcher
+        )
+        if matcher is None:
+            return None
+        result = matcher.match(rel_path)
+        if result is None:
+            return None
+        return specs[result.lastindex or 0]
+
+    def can_match_below(self, rel_dir: str) -> bool:
+        """Get whether any rule can match an object below a directory."""
+        if self._prefixes is None:
+            return True
+        parts = tuple(rel_dir.split("/"))
+        return any(parts[: len(prefix)] == prefix[: len(parts)] for prefix in self._prefixes)
+
+
+POLICY_OBJECT_TYPES: Final[Mapping[str, ModeObjectType]] = {
+    "file": ModeObjectType.FILE,
+    "dir": ModeObjectType.DIRECTORY,
+}
+
+
+def apply_policy(
+    root: ModePathInput,
+    rules: Union[ModePolicy, Iterable[Union[ModeRule, Tuple[Any, ...]]]],
+    first_match: bool = True,
+    only_changes: bool = False,
+    counts: Optional[ModeCounts] = None,
+) -> ModeCounts:
+    """Set modes of objects below root according to rules, in a single walk.
+
+    Each object below root is given the mode of the rule matching its path
+    relative to root (see `ModeRule` and `ModePolicy`); objects matching no
+    rule, root itself and symbolic links are left untouched. Directories
+    below which no rule can match are not descended into. As with
+    `set_mode_recursive()`, directories are set after their contents.
+
+    Returns counts of objects changed and unchanged, which are also added
+    to `counts` if given. If `counts` is a `RunStats`, the objects set are
+    recorded (and reported to its callbacks) as they are, and it is returned.
+    """
+    policy = rules if isinstance(rules, ModePolicy) else ModePolicy(rules, first_match)
+    total = ModeCounts()
+    stats = counts if isinstance(counts, RunStats) else None
+    _root = _to_path(root)
+    for handle, rel_dir, entry in _scandir_walk(
+        _root,
+        HAS_DIR_FD and not IS_WINDOWS,
+        lambda rel_path, _: policy.can_match_below(rel_path),
+    ):
+        if entry.is_symlink():
+            continue
+        spec = policy.match(
+            f"{rel_dir}/{entry.name}" if rel_dir else entry.name,
+            ModeObjectType.DIRECTORY if entry.is_dir() else ModeObjectType.FILE,
+        )
+        if spec is None:
+            continue
+        if stats is not None:
+            entry_path = (
+                os.path.join(_root, rel_dir.replace("/", os.sep), entry.name)
+                if isinstance(handle, int)
+                else entry.path
+            )
+            _set_mode_instrumented(handle, entry, entry_path, spec, only_changes, stats)
+        else:
+            _set_entry_mode(handle, entry, spec, only_changes, total)
+
+    if counts is not None and stats is None:
+        counts += total
+    return total if stats is None else stats
+
+
+_RuleMatcher = Tuple[Optional["re.Pattern[str]"], Mapping[int, ModeSpec]]
+
+
+def _compile_rules(rules: Iterable[ModeRule]) -> _RuleMatcher:
+    """Combine rules into one expression, mapping the group of each rule to its mode."""
+    alternatives: List[str] = []
+    specs: Dict[int, ModeSpec] = {}
+    group = 1
+    for rule in rules:
+        expression = rule.pattern if rule.regex else _glob_to_regex(rule.pattern)
+        alternatives.append(f"({expression})")
+        specs[group] = ModeSpec.compile(rule.mode)
+        group += 1 + re.compile(expression).groups
+
+    if not alternatives:
+        return None, specs
+    return re.compile("(?:" + "|".join(alternatives) + r")\Z"), specs
+
+
+def _glob_to_regex(pattern: str) -> str:
+    """Translate a path glob to a regular expression."""
+    anchored = "/" in pattern.rstrip("/")
+    pattern = pattern.strip("/")
+    parts: List[str] = []
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if pattern.startswith("**/", index):
+            parts.append("(?:.*/)?")
+            index += 3
+            continue
+        if pattern.startswith("**", index):
+            parts.append(".*")
+            index += 2
+            continue
+        if char == "*":
+            parts.append("[^/]*")
+        elif char == "?":
+            parts.append("[^/]")
+        elif char == "[" and "]" in pattern[index + 2 :]:
+            end = pattern.index("]", index + 2)
+            content = pattern[index + 1 : end]
+            if content.startswith("!"):
+                content = "^" + content[1:]
+            parts.append("[" + content.replace("\\", "\\\\") + "]")
+            index = end + 1
+            continue
+        else:
+            parts.append(re.escape(char))
+        index += 1
+    return ("" if anchored else "(?:.*/)?") + "".join(parts)
+
+
+def _get_rule_prefix(rule: ModeRule) -> Optional[Tuple[str, ...]]:
+    """Get literal directories a rule's matches must be under, if known."""
+    if rule.regex or "/" not in rule.pattern.rstrip("/"):
+        return None
+
+    prefix: List[str] = []
+    for part in rule.pattern.strip("/").split("/")[:-1]:
+        if any(char in part for char in "*?["):
+            break
+        prefix.append(part)
+    return tuple(prefix)
+
+
+class ModeRecord(NamedTuple):
+    """Mode and ownership of one object in a tree."""
+
+    path: str
+    mode: ModeValue
+    object_type: ModeObjectType
+    uid: int
+    gid: int
+
+    @property
+    def owner(self) -> Optional[str]:
+        """Return name of the owner (cached, see `get_user_name()`)."""
+        return get_user_name(self.uid)
+
+    @property
+    def group(self) -> Optional[str]:
+        """Return name of the group (cached, see `get_group_name()`)."""
+        return get_group_name(self.gid)
+
+
+def iter_modes(
+    root: ModePathInput,
+    follow_symlinks: bool = False,
+    onerror: Optional[Callable[[OSError], None]] = None,
+) -> Iterator[ModeRecord]:
+    """Iterate over modes of root and every object below it.
+
+    Records are yielded top-down, with the entries of each directory sorted
+    by name, and paths relative to root (root itself is "."). Data comes from
+    `os.scandir()` so each object costs a single stat relative to an open
+    directory fd (where supported), and only the directories on the current
+    branch are held in memory.
+
+    If `follow_symlinks` is True, symbolic links report the object they
+    point to and linked directories are descended into (skipping cycles).
+    Otherwise links are reported as `ModeObjectType.LINK`. Errors listing a
+    directory are passed to `onerror` if given, else raised.
+    """
+    _root = _to_path(root)
+    root_stat = os.stat(_root)
+    yield _to_mode_record(".", _root, root_stat)
+    if not stat.S_ISDIR(root_stat.st_mode):
+        return
+
+    use_fd = HAS_DIR_FD and not IS_WINDOWS
+    open_flags = DIR_OPEN_FLAGS
+    if follow_symlinks:
+        open_flags &= ~getattr(os, "O_NOFOLLOW", 0)
+    ancestors = {(root_stat.st_dev, root_stat.st_ino)}
+    root_handle: Union[int, str] = os.open(_root, open_flags) if use_fd else _root
+    stack = [(".", root_handle, iter(_sorted_entries(root_handle)), (0, 0))]
+    try:
+        while stack:
+            rel_dir, handle, entries, key = stack[-1]
+            for entry in entries:
+                rel_path = entry.name if rel_dir == "." else os.path.join(rel_dir, entry.name)
+                entry_stat = _entry_stat(entry, follow_symlinks)
+                yield _to_mode_record(rel_path, os.path.join(_root, rel_path), entry_stat)
+
+                child_key = (entry_stat.st_dev, entry_stat.st_ino)
+                if not stat.S_ISDIR(entry_stat.st_mode) or child_key in ancestors:
+                    continue
+                try:
+                    child: Union[int, str] = (
+                        os.open(entry.name, open_flags, dir_fd=handle)  # type: ignore[arg-type]
+                        if use_fd
+                        else entry.path
+                    )
+                    child_entries = _sorted_entries(child)
+                except OSError as exc:
+                    if onerror is None:
+                        raise
+                    onerror(exc)
+                    continue
+                ancestors.add(child_key)
+                stack.append((rel_path, child, iter(child_entries), child_key))
+                break
+            else:
+                stack.pop()
+                ancestors.discard(key)
+                if use_fd:
+                    os.close(handle)  # type: ignore[arg-type]
+    finally:
+        if use_fd:
+            for _, handle, _, _ in stack:
+                os.close(handle)  # type: ignore[arg-type]
+
+
+def _sorted_entries(handle: Union[int, str]) -> List["os.DirEntry[str]"]:
+    """List a directory (by fd or path) sorted by name."""
+    with os.scandir(handle) as entries:  # type: ignore[type-var]
+        return sorted(entries, key=lambda entry: entry.name)
+
+
+def _entry_stat(entry: "os.DirEntry[str]", follow_symlinks: bool) -> os.stat_result:
+    """Stat a directory entry, falling back to the link itself if it is broken."""
+    if follow_symlinks:
+        try:
+            return entry.stat()
+        except FileNotFoundError:
+            pass
+    return entry.stat(follow_symlinks=False)
+
+
+def _to_mode_record(rel_path: str, path: str, stat_result: os.stat_result) -> ModeRecord:
+    """Create record of an object from its stat result."""
+    if stat.S_ISDIR(stat_result.st_mode):
+        object_type = ModeObjectType.DIRECTORY
+    elif stat.S_ISLNK(stat_result.st_mode):
+        object_type = ModeObjectType.LINK
+    else:
+        object_type = ModeObjectType.FILE
+
+    if IS_WINDOWS and object_type != ModeObjectType.LINK:
+        mode = _win_get_permissions(ModePathInternal(path), object_type)
+    else:
+        mode = stat_result.st_mode & (stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
+    return ModeRecord(rel_path, mode, object_type, stat_result.st_uid, stat_result.st_gid)
+
+
+ManifestInput = Union[ModePathInput, BinaryIO]
+
+MANIFEST_MAGIC: Final[bytes] = b"OSCHMODM"
+MANIFEST_VERSION: Final[int] = 1
+MANIFEST_BLOCK_SIZE: Final[int] = 4096
+GZIP_MAGIC: Final[bytes] = b"\x1f\x8b"
+
+_MANIFEST_HEADER = struct.Struct("<8sH")
+_MANIFEST_BLOCK_HEADER = struct.Struct("<II")
+
+
+def snapshot_modes(
+    root: ModePathInput,
+    out_file: ManifestInput,
+    compress: bool = False,
+    follow_symlinks: bool = False,
+) -> int:
+    """Save modes of root and every object below it to a manifest.
+
+    The manifest is a compact binary file written in blocks of up to
+    `MANIFEST_BLOCK_SIZE` records as the tree is walked (see `iter_modes()`),
+    so memory use does not grow with the size of the tree. Each block holds
+    a table of front coded paths followed by `array` columns of modes,
+    object types, uids and gids. If `compress` is True, the manifest is
+    gzip compressed.
+
+    Returns the number of records saved.
+    """
+    count = 0
+    with _open_manifest(out_file, "wb", compress) as stream:
+        stream.write(_MANIFEST_HEADER.pack(MANIFEST_MAGIC, MANIFEST_VERSION))
+        block: List[ModeRecord] = []
+        for record in iter_modes(root, follow_symlinks):
+            block.append(record)
+            if len(block) == MANIFEST_BLOCK_SIZE:
+                stream.write(_pack_manifest_block(block))
+                count += len(block)
+                block = []
+        if block:
+            stream.write(_pack_manifest_block(block))
+            count += len(block)
+        stream.write(_MANIFEST_BLOCK_HEADER.pack(0, 0))
+    return count
+
+
+def iter_manifest(manifest: ManifestInput) -> Iterator[ModeRecord]:
+    """Iterate over records of a manifest saved by `snapshot_modes()`.
+
+    Records are read one block at a time, in the order they were saved.
+    """
+    with _open_manifest(manifest, "rb") as stream:
+        magic, version = _MANIFEST_HEADER.unpack(_read_exactly(stream, _MANIFEST_HEADER.size))
+        if magic != MANIFEST_MAGIC or version != MANIFEST_VERSION:
+            raise ValueError("not an oschmod manifest (or unsupported version)")
+
+        while True:
+            count, suffix_size = _MANIFEST_BLOCK_HEADER.unpack(
+                _read_exactly(stream, _MANIFEST_BLOCK_HEADER.size)
+            )
+            if count == 0:
+                return
+            yield from _unpack_manifest_block(stream, count, suffix_size)
+
+
+def restore_modes(
+    manifest: ManifestInput,
+    root: ModePathInput,
+    counts: Optional[ModeCounts] = None,
+    onerror: Optional[Callable[[OSError], None]] = None,
+) -> ModeCounts:
+    """Restore modes saved by `snapshot_modes()` to the tree at root.
+
+    The manifest is streamed and only objects whose live mode differs from
+    the saved mode are changed. Objects are set relative to their open
+    parent directory (where supported) and directories are set after their
+    contents. Symbolic links are skipped. Errors (e.g., objects that no
+    longer exist) are passed to `onerror` if given, else raised.
+
+    Returns the counts of objects changed and unchanged, which are also
+    added to `counts` if given.
+    """
+    _root = _to_path(root)
+    total = ModeCounts()
+    use_fd = HAS_DIR_FD and not IS_WINDOWS
+    stack: List[Tuple[str, Union[int, str, None], ModeValue]] = []
+
+    def handle_error(exc: OSError) -> None:
+        if onerror is None:
+            raise exc
+        onerror(exc)
+
+    try:
+        for record in iter_manifest(manifest):
+            parent, name = os.path.split(record.path)
+            if record.path == ".":
+                if record.object_type != ModeObjectType.DIRECTORY:
+                    _set_mode(_root, record.mode, True, total)
+                    continue
+                root_handle = os.open(_root, DIR_OPEN_FLAGS) if use_fd else _root
+                stack.append((".", root_handle, record.mode))
+                continue
+
+            while stack and stack[-1][0] != (parent or "."):
+                _restore_dir_mode(stack.pop(), total, handle_error)
+            if not stack:
+                raise ValueError(f"manifest is not in tree order at {record.path}")
+
+            handle = stack[-1][1]
+            if handle is None or record.object_type == ModeObjectType.LINK:
+                continue
+
+            try:
+                if record.object_type == ModeObjectType.DIRECTORY:
+                    child: Union[int, str, None] = (
+                        os.open(name, DIR_OPEN_FLAGS, dir_fd=handle)  # type: ignore[arg-type]
+                        if use_fd
+                        else os.path.join(_root, record.path)
+                    )
+                    stack.append((record.path, child, record.mode))
+                elif use_fd:
+                    _set_mode_at(handle, name, ModeSpec.compile(record.mode), True, total)  # type: ignore[arg-type]
+                else:
+                    _set_mode(
+                        ModePathInternal(os.path.join(_root, record.path)),
+                        record.mode,
+                        True,
+                        total,
+                    )
+            except OSError as exc:
+                if record.object_type == ModeObjectType.DIRECTORY:
+                    stack.append((record.path, None, record.mode))
+                handle_error(exc)
+
+        while stack:
+            _restore_dir_mode(stack.pop(), total, handle_error)
+    finally:
+        if use_fd:
+            for _, handle, _ in stack:
+                if handle is not None:
+                    os.close(handle)  # type: ignore[arg-type]
+
+    if counts is not None:
+        counts += total
+    return total
+
+
+class ModeDiff(NamedTuple):
+    """Difference between the saved and live record of one object."""
+
+    path: str
+    change: ModeChangeType
+    old: Optional[ModeRecord]
+    new: Optional[ModeRecord]
+
+
+def diff_modes(
+    manifest: ManifestInput, root: ModePathInput, follow_symlinks: bool = False
+) -> Iterator[ModeDiff]:
+    """Iterate over differences between a manifest and the live tree at root.
+
+    Nothing is changed. The manifest (see `snapshot_modes()`) and the tree
+    (see `iter_modes()`) are both streamed in tree order and merged, so
+    memory use does not depend on the size of either. Objects only in the
+    tree are `ModeChangeType.ADDED`, objects only in the manifest are
+    `ModeChangeType.REMOVED` and objects whose mode (permission bits, as
+    given by `get_mode()`) or object type differ are `ModeChangeType.CHANGED`.
+    """
+    saved = iter_manifest(manifest)
+    live = iter_modes(root, follow_symlinks)
+    old = next(saved, None)
+    new = next(live, None)
+    while old is not None and new is not None:
+        old_key = _tree_order_key(old.path)
+        new_key = _tree_order_key(new.path)
+        if old_key < new_key:
+            yield ModeDiff(old.path, ModeChangeType.REMOVED, old, None)
+            old = next(saved, None)
+        elif new_key < old_key:
+            yield ModeDiff(new.path, ModeChangeType.ADDED, None, new)
+            new = next(live, None)
+        else:
+            if old.mode != new.mode or old.object_type != new.object_type:
+                yield ModeDiff(new.path, ModeChangeType.CHANGED, old, new)
+            old = next(saved, None)
+            new = next(live, None)
+
+    while old is not None:
+        yield ModeDiff(old.path, ModeChangeType.REMOVED, old, None)
+        old = next(saved, None)
+
+    while new is not None:
+        yield ModeDiff(new.path, ModeChangeType.ADDED, None, new)
+        new = next(live, None)
+
+
+def _tree_order_key(path: str) -> Tuple[str, ...]:
+    """Get sort key giving the order `iter_modes()` yields paths in."""
+    return () if path == "." else tuple(path.split(os.sep))
+
+
+def _restore_dir_mode(
+    frame: Tuple[str, Union[int, str, None], ModeValue],
+    counts: ModeCounts,
+    handle_error: Callable[[OSError], None],
+) -> None:
+    """Set mode of a directory being restored, once its contents are done."""
+    _, handle, mode = frame
+    if handle is None:
+        return
+
+    try:
+        if isinstance(handle, int):
+            try:
+                if os.fstat(handle).st_mode & (stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO) == mode:
+                    counts.unchanged += 1
+                else:
+                    os.fchmod(handle, mode)  # pylint: disable=no-member
+                    counts.changed += 1
+            finally:
+                os.close(handle)
+        else:
+            _set_mode(ModePathInternal(handle), mode, True, counts)
+    except OSError as exc:
+        handle_error(exc)
+
+
+@contextlib.contextmanager
+def _open_manifest(
+    manifest: ManifestInput, mode: str, compress: bool = False
+) -> Iterator[IO[bytes]]:
+    """Open manifest path or file object, (de)compressing as needed."""
+    with contextlib.ExitStack() as stack:
+        if hasattr(manifest, "read") or hasattr(manifest, "write"):
+            stream: IO[bytes] = manifest  # type: ignore[assignment]
+        else:
+            stream = stack.enter_context(open(manifest, mode))  # type: ignore[arg-type]  # pylint: disable=consider-using-with,unspecified-encoding
+
+        if mode == "rb":
+            compress = _peek(stream, len(GZIP_MAGIC)) == GZIP_MAGIC
+        if compress:
+            stream = stack.enter_context(gzip.GzipFile(fileobj=stream, mode=mode))  # type: ignore[arg-type]
+        yield stream
+
+
+def _peek(stream: IO[bytes], size: int) -> bytes:
+    """Get the first bytes of a stream without consuming them, if possible."""
+    if hasattr(stream, "peek"):
+        return stream.peek(size)[:size]  # type: ignore[attr-defined]
+    if stream.seekable():
+        position = stream.tell()
+        data = stream.read(size)
+        stream.seek(position)
+        return data
+    return b""
+
+
+def _read_exactly(stream: IO[bytes], size: int) -> bytes:
+    """Read exactly size bytes from a stream."""
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError("truncated oschmod manifest")
+    return data
+
+
+def _pack_manifest_block(records: List[ModeRecord]) -> bytes:
+    """Pack records into a manifest block."""
+    prefixes = array.array("I")
+    suffixes: List[bytes] = []
+    previous = b""
+    for record in records:
+        path = os.fsencode(record.path.replace(os.sep, "/"))
+        prefix = len(os.path.commonprefix([previous, path]))
+        prefixes.append(prefix)
+        suffixes.append(path[prefix:])
+        previous = path
+    suffix_data = b"\0".join(suffixes)
+
+    columns = [
+        prefixes,
+        array.array("H", (record.mode for record in records)),
+        array.array("B", (record.object_type for record in records)),
+        array.array("I", (record.uid for record in records)),
+        array.array("I", (record.gid for record in records)),
+    ]
+    if sys.byteorder != "little":
+        for column in columns:
+            column.byteswap()
+
+    header = _MANIFEST_BLOCK_HEADER.pack(len(records), len(suffix_data))
+    return b"".join([header, suffix_data] + [column.tobytes() for column in columns])
+
+
+def _unpack_manifest_block(stream: IO[bytes], count: int, suffix_size: int) -> List[ModeRecord]:
+    """Unpack records of a manifest block."""
+    suffixes = _read_exactly(stream, suffix_size).split(b"\0")
+    columns = []
+    for typecode in ("I", "H", "B", "I", "I"):
+        column = array.array(typecode)
+        column.frombytes(_read_exactly(stream, column.itemsize * count))
+        if sys.byteorder != "little":
+            column.byteswap()
+        columns.append(column)
+    prefixes, modes, object_types, uids, gids = columns
+
+    records: List[ModeRecord] = []
+    previous = b""
+    for index in range(count):
+        path = previous[: prefixes[index]] + suffixes[index]
+        previous = path
+        records.append(
+            ModeRecord(
+                os.fsdecode(path).replace("/", os.sep),
+                modes[index],
+                ModeObjectType(object_types[index]),
+                uids[index],
+                gids[index],
+            )
+        )
+    return records
+
+
+NAME_CACHE_SIZE: Final[int] = 4096
+
+
+class NameCache:
+    """Bounded, thread-safe LRU cache of user or group names by id.
+
+    Names are looked up with `lookup` (which raises `KeyError` for unknown
+    ids, cached as None) at most once per id, or once per `ttl` seconds if
+    set. Lookups run outside the lock so that slow name services (e.g.,
+    LDAP) do not serialize threads. `hits` and `misses` count calls to
+    `get()` answered from the cache or not, to help tune `maxsize` and
+    `ttl`, which can be changed at any time.
+    """
+
+    __slots__ = ("_lookup", "_entries", "_lock", "maxsize", "ttl", "hits", "misses")
+
+    def __init__(
+        self,
+        lookup: Callable[[int], str],
+        maxsize: int = NAME_CACHE_SIZE,
+        ttl: Optional[float] = None,
+    ) -> None:
+        """Create empty cache."""
+        self._lookup = lookup
+        self._entries: "collections.OrderedDict[int, Tuple[Optional[str], float]]" = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self) -> str:
+        """Return string representation."""
+        return (
+            f"NameCache(size={len(self._entries)}, maxsize={self.maxsize}, ttl={self.ttl}, "
+            f"hits={self.hits}, misses={self.misses})"
+        )
+
+    def get(self, ident: int) -> Optional[str]:
+        """Get name of an id, or None if it is unknown."""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(ident)
+            if cached is not None and (self.ttl is None or now - cached[1] < self.ttl):
+                self._entries.move_to_end(ident)
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+
+        try:
+            name: Optional[str] = self._lookup(ident)
+        except KeyError:
+            name = None
+        with self._lock:
+            self._entries[ident] = (name, now)
+            self._entries.move_to_end(ident)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return name
+
+    def invalidate(self, ident: Optional[int] = None) -> None:
+        """Forget the name of an id, or of all ids if None."""
+        with self._lock:
+            if ident is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(ident, None)
+
+
+USER_NAME_CACHE: Final[NameCache] = NameCache(lambda uid: getpwuid(uid).pw_name)
+GROUP_NAME_CACHE: Final[NameCache] = NameCache(lambda gid: getgrgid(gid).gr_name)
+
+
+def get_user_name(uid: int) -> Optional[str]:
+    """Get name of a user id through `USER_NAME_CACHE`, or None if unknown."""
+    return USER_NAME_CACHE.get(uid)
+
+
+def get_group_name(gid: int) -> Optional[str]:
+    """Get name of a group id through `GROUP_NAME_CACHE`, or None if unknown."""
+    return GROUP_NAME_CACHE.get(gid)
+
+
+def clear_name_cache() -> None:
+    """Forget user and group names, e.g., after accounts were changed."""
+    USER_NAME_CACHE.invalidate()
+    GROUP_NAME_CACHE.invalidate()
+
+
 def get_owner(path: ModePathInput) -> ModeSidObject:
     """Get the object owner."""
     if IS_WINDOWS:
         sid = _get_account_sid(SYSTEM_NAME_NONE, win_get_owner_sid(path))
     else:
-        sid = getpwuid(os.stat(_to_path(path)).st_uid).pw_name  # type: ignore[assignment]
+        uid = os.stat(_to_path(path)).st_uid
+        sid = get_user_name(uid)  # type: ignore[assignment]
+        if sid is None:
+            raise KeyError(f"getpwuid(): uid not found: {uid}")
     return sid
 
 
@@ -664,7 +2926,10 @@ def get_group(path: ModePathInput) -> ModeSidObject:
     if IS_WINDOWS:
         sid = _get_account_sid(SYSTEM_NAME_NONE, win_get_group_sid(path))
     else:
-        sid = getgrgid(os.stat(_to_path(path)).st_gid).gr_name  # type: ignore[assignment]
+        gid = os.stat(_to_path(path)).st_gid
+        sid = get_group_name(gid)  # type: ignore[assignment]
+        if sid is None:
+            raise KeyError(f"getgrgid(): gid not found: {gid}")
     return sid
 
 
@@ -744,12 +3009,75 @@ def win_get_object_sids(
     }
 
 
-def _to_path(path: ModePathInput) -> ModePathInternal:
-    """Convert path to string."""
-    absolute_resolved_path = str(pathlib.Path(str(path)).resolve().absolute())
-    if not os.path.exists(absolute_resolved_path):
-        raise FileNotFoundError(f"Path {path} could not be found.")
-    return ModePathInternal(absolute_resolved_path)
+def _to_path(path: ModePathInput, resolve: bool = True) -> ModePathInternal:
+    """Convert path to absolute path string.
+
+    If resolve is True, symbolic links are resolved and the path must exist.
+    Within `path_cache()`, parent directories are resolved through a
+    bounded cache, so only the last component is looked up, with a single
+    `lstat` that also checks the path exists. Otherwise the path is only
+    made absolute and a missing path is reported by whatever uses it.
+    """
+    # not normalized: "link/.." is the parent of the link's target, not the link's directory
+    absolute_path = os.path.join(os.getcwd(), os.fspath(path))
+    if not resolve:
+        return ModePathInternal(absolute_path)
+
+    parent, name = os.path.split(absolute_path)
+    try:
+        if name in ("", ".", "..") or ".." in parent.replace("/", os.sep).split(os.sep):
+            resolved_path = str(pathlib.Path(absolute_path).resolve(strict=True))
+        else:
+            resolved_path = os.path.join(_resolve_dir(parent), name)
+            if stat.S_ISLNK(os.lstat(resolved_path).st_mode):
+                resolved_path = str(pathlib.Path(resolved_path).resolve(strict=True))
+    except (OSError, RuntimeError) as exc:
+        raise FileNotFoundError(f"Path {path} could not be found.") from exc
+    return ModePathInternal(resolved_path)
+
+
+_PATH_CACHE = threading.local()
+
+
+@contextlib.contextmanager
+def path_cache() -> Iterator[None]:
+    """Remember resolved parent directories of paths until the context exits.
+
+    Use it around a batch of calls on paths sharing directories (e.g., a
+    loop of `set_mode()`), so each directory is resolved once. Outside of
+    it, directories are resolved on every call, so symbolic links changed
+    meanwhile are always seen. The cache holds at most `PATH_CACHE_SIZE`
+    directories and belongs to the current thread; nested contexts share
+    the outermost one.
+    """
+    if getattr(_PATH_CACHE, "dirs", None) is not None:
+        yield
+        return
+    _PATH_CACHE.dirs = {}
+    try:
+        yield
+    finally:
+        _PATH_CACHE.dirs = None
+
+
+def _resolve_dir(path: str) -> str:
+    """Resolve symbolic links of a directory path, memoized within `path_cache()`."""
+    dirs: Optional[Dict[str, str]] = getattr(_PATH_CACHE, "dirs", None)
+    if dirs is None:
+        return os.path.realpath(path)
+    resolved = dirs.get(path)
+    if resolved is None:
+        if len(dirs) >= PATH_CACHE_SIZE:
+            del dirs[next(iter(dirs))]
+        resolved = dirs[path] = os.path.realpath(path)
+    return resolved
+
+
+def clear_path_cache() -> None:
+    """Forget directories resolved in the current `path_cache()`, e.g., after links changed."""
+    dirs: Optional[Dict[str, str]] = getattr(_PATH_CACHE, "dirs", None)
+    if dirs is not None:
+        dirs.clear()
 
 
 def win_get_permissions(path: ModePathInput) -> ModeValue:
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""Asynchronous (asyncio) interface for the 'oschmod' library.
+
+Every file system call is run in a bounded thread pool so that the event loop
+is never blocked, and recursive operations stream their progress:
+
+    async for path, mode in oschmod.aio.iter_set_mode_recursive("uploads", "go-w"):
+        ...
+
+Cancelling the task consuming a recursive operation stops the walk at the
+next object; operations already handed to the thread pool still complete.
+"""
+
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Final,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+from oschmod import (
+    ModeInputValue,
+    ModeObjectType,
+    ModePathInput,
+    ModePathInternal,
+    ModeSpec,
+    ModeValue,
+    _get_mode,
+    _get_object_type,
+    _set_mode,
+    _to_path,
+)
+
+DEFAULT_WORKERS: Final[int] = 8
+DEFAULT_LIMIT: Final[int] = 32
+
+_T = TypeVar("_T")
+_R = TypeVar("_R")
+
+_executor: Optional[Executor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> Executor:
+    """Get the thread pool shared by asynchronous operations."""
+    global _executor  # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=DEFAULT_WORKERS, thread_name_prefix="oschmod"
+            )
+        return _executor
+
+
+def _run(executor: Optional[Executor], func: Callable[..., _T], *args: object) -> Awaitable[_T]:
+    """Run a blocking function in the executor."""
+    return asyncio.get_running_loop().run_in_executor(
+        executor or _get_executor(), functools.partial(func, *args)
+    )
+
+
+async def get_mode(path: ModePathInput, executor: Optional[Executor] = None) -> ModeValue:
+    """Get bitwise mode (stat) of object (dir or file)."""
+    return await _run(executor, lambda: _get_mode(_to_path(path)))
+
+
+async def set_mode(
+    path: ModePathInput, mode: ModeInputValue, executor: Optional[Executor] = None
+) -> ModeValue:
+    """Set bitwise mode (stat) of object (dir or file)."""
+    spec = ModeSpec.compile(mode)
+    return await _run(executor, lambda: _set_mode(_to_path(path), spec))
+
+
+async def set_mode_recursive(
+    path: ModePathInput,
+    mode: ModeInputValue,
+    dir_mode: Optional[ModeInputValue] = None,
+    limit: int = DEFAULT_LIMIT,
+    executor: Optional[Executor] = None,
+) -> ModeValue:
+    """Set all file and directory permissions at or under path to modes.
+
+    Returns the mode of path, which is set last. See
+    `iter_set_mode_recursive()` for the arguments.
+    """
+    new_mode = 0
+    async for _, new_mode in iter_set_mode_recursive(path, mode, dir_mode, limit, executor):
+        pass
+    return new_mode
+
+
+async def iter_set_mode_recursive(
+    path: ModePathInput,
+    mode: ModeInputValue,
+    dir_mode: Optional[ModeInputValue] = None,
+    limit: int = DEFAULT_LIMIT,
+    executor: Optional[Executor] = None,
+) -> AsyncIterator[Tuple[ModePathInternal, ModeValue]]:
+    """Set modes at or under path, yielding each object and its new mode.
+
+    Args:
+    ----
+    path: (:obj:`str`)
+        File, or directory whose mode and the modes of everything below it
+        are set. Directories are set after their contents and path is last.
+
+    mode: (`int`, `str` or `ModeSpec`)
+        Mode to be applied to object(s).
+
+    dir_mode: (`int`, `str` or `ModeSpec`)
+        If provided, this mode is given to all directories only.
+
+    limit: (`int`)
+        Maximum number of operations of this walk in flight at once, so a
+        large tree cannot monopolize the thread pool.
+
+    executor: (`concurrent.futures.Executor`)
+        Executor used for file system calls instead of the shared pool.
+
+    """
+    _path = await _run(executor, _to_path, path)
+    file_spec = ModeSpec.compile(mode)
+
+    if await _run(executor, _get_object_type, _path) == ModeObjectType.FILE:
+        yield _path, await _run(executor, _set_mode, _path, file_spec)
+        return
+
+    dir_spec = ModeSpec.compile(dir_mode) if dir_mode else file_spec
+    semaphore = asyncio.Semaphore(limit)
+
+    def set_file(one_path: ModePathInternal) -> Tuple[ModePathInternal, ModeValue]:
+        return one_path, _set_mode(one_path, file_spec)
+
+    def set_dir(one_path: ModePathInternal) -> Tuple[ModePathInternal, ModeValue]:
+        return one_path, _set_mode(one_path, dir_spec)
+
+    stack: List[Tuple[ModePathInternal, List[Tuple[ModePathInternal, bool]]]] = []
+    files, subdirs = await _run(executor, _scan_dir, _path)
+    stack.append((_path, subdirs))
+    async for result in _bounded_map(executor, semaphore, set_file, files):
+        yield result
+
+    while stack:
+        dir_path, subdirs = stack[-1]
+        if not subdirs:
+            stack.pop()
+            yield await _run(executor, set_dir, dir_path)
+            continue
+
+        subdir, is_link = subdirs.pop()
+        if is_link:
+            yield await _run(executor, set_dir, subdir)
+            continue
+
+        files, children = await _run(executor, _scan_dir, subdir)
+        stack.append((subdir, children))
+        async for result in _bounded_map(executor, semaphore, set_file, files):
+            yield result
+
+
+def _scan_dir(
+    path: ModePathInternal,
+) -> Tuple[List[ModePathInternal], List[Tuple[ModePathInternal, bool]]]:
+    """List files and subdirectories (and whether each is a symbolic link) of a directory."""
+    files: List[ModePathInternal] = []
+    subdirs: List[Tuple[ModePathInternal, bool]] = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                subdirs.append((ModePathInternal(entry.path), entry.is_symlink()))
+            else:
+                files.append(ModePathInternal(entry.path))
+    return files, subdirs
+
+
+async def _bounded_map(
+    executor: Optional[Executor],
+    semaphore: asyncio.Semaphore,
+    func: Callable[[_T], _R],
+    items: Iterable[_T],
+) -> AsyncIterator[_R]:
+    """Run func over items in the executor, yielding results as they complete."""
+    pending: Set["asyncio.Future[_R]"] = set()
+    try:
+        for item in items:
+            await semaphore.acquire()
+            future = asyncio.ensure_future(_run(executor, func, item))
+            future.add_done_callback(lambda _: semaphore.release())
+            pending.add(future)
+            for done in [one for one in pending if one.done()]:
+                pending.discard(done)
+                yield done.result()
+
+        while pending:
+            done_set, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for done in done_set:
+                yield done.result()
+    finally:
+        for pending_future in pending:
+            pending_future.cancel()
@@ -10,23 +10,593 @@ from __future__ import (
 )
 
 import argparse
+import functools
+import itertools
+import json
+import os
+import stat
+import sys
+import tempfile
+import time
 
 import oschmod
+import oschmod.watch
 
 
-def main():
+def main(argv=None):
     """Provide main function for CLI."""
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] in COMMANDS:
+        return COMMANDS[argv[0]](argv[1:])
+
     parser = argparse.ArgumentParser(
-        description="Change the mode (permissions) of a file or directory"
+        description="Change the mode (permissions) of files or directories",
+        epilog="other commands: " + ", ".join(sorted(COMMANDS)) + " (see 'oschmod COMMAND -h')",
     )
     parser.add_argument("-R", action="store_true", help="apply mode recursively")
-    parser.add_argument("mode", nargs=1, help="octal or symbolic mode of the object")
-    parser.add_argument("object", nargs=1, help="file or directory")
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="report every object processed"
+    )
+    parser.add_argument(
+        "-c", "--changes", action="store_true", help="report only objects whose mode changed"
+    )
+    parser.add_argument(
+        "--reference",
+        metavar="RFILE",
+        help="use the mode of RFILE instead of a mode (all operands are objects)",
+    )
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="print the changes (JSON lines) that would be made, without making them",
+    )
+    parser.add_argument(
+        "--files-from",
+        metavar="FILE",
+        help="also set the mode of objects listed in FILE, one per line ('-' for stdin)",
+    )
+    parser.add_argument(
+        "-0",
+        "--null",
+        action="store_true",
+        help="objects in --files-from are separated by NUL characters (e.g., find -print0)",
+    )
+    parser.add_argument(
+        "--walker",
+        choices=["auto", "scandir", "walk"],
+        default="auto",
+        help="engine used to walk directories with -R (default: scandir where supported)",
+    )
+    parser.add_argument(
+        "--changes-only",
+        action="store_true",
+        help="only set modes of objects whose mode differs from the target",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        metavar="N",
+        help="number of threads used to set modes with -R",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        metavar="N",
+        help="number of processes used to set modes of subtrees with -R",
+    )
+    parser.add_argument(
+        "--include",
+        action="append",
+        default=[],
+        metavar="PATTERN",
+        help="with -R, only set objects matching PATTERN (a glob relative to the object)",
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        default=[],
+        metavar="PATTERN",
+        help="with -R, leave alone (and do not list) objects matching PATTERN",
+    )
+    parser.add_argument(
+        "--max-depth",
+        type=int,
+        default=None,
+        metavar="N",
+        help="with -R, descend at most N levels below each object",
+    )
+    parser.add_argument(
+        "-x",
+        "--one-file-system",
+        action="store_true",
+        help="with -R, leave alone directories on other file systems",
+    )
+    parser.add_argument(
+        "--symlinks",
+        choices=["follow", "no-follow", "skip"],
+        default="follow",
+        help="with -R, set the mode of link targets (default), of links themselves "
+        "(where links have modes) or leave links alone",
+    )
+    parser.add_argument(
+        "--state-file",
+        metavar="PATH",
+        help="with -R, record directories in PATH and skip those unchanged since the last run",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="with --state-file, set every object and record the tree again",
+    )
+    parser.add_argument(
+        "--policy",
+        metavar="FILE",
+        help="set modes below a directory from rules ('PATTERN MODE [file|dir]' lines)",
+    )
+    parser.add_argument(
+        "--last-match-wins",
+        action="store_true",
+        help="with --policy, use the last matching rule instead of the first",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        metavar="PATH",
+        help="write metrics of the run to PATH (e.g., for the node_exporter textfile collector)",
+    )
+    parser.add_argument(
+        "--metrics-format",
+        choices=["prometheus", "json"],
+        help="format of --metrics-file (default: json if PATH ends with .json, else prometheus)",
+    )
+    parser.add_argument("mode", nargs="?", help="octal or symbolic mode of the objects")
+    parser.add_argument("objects", nargs="*", metavar="object", help="files or directories")
 
-    args = parser.parse_args()
-    mode = args.mode[0]
-    obj = args.object[0]
+    args = parser.parse_intermixed_args(argv)
+    operands = ([args.mode] if args.mode is not None else []) + args.objects
+    filtered = bool(
+        args.include
+        or args.exclude
+        or args.max_depth is not None
+        or args.one_file_system
+        or args.symlinks != "follow"
+    )
+    parallel = (args.jobs or 0) > 1 or (args.processes or 0) > 1
+    if filtered and parallel:
+        parser.error(
+            "--include, --exclude, --max-depth, -x and --symlinks cannot be combined with "
+            + ("-j" if (args.jobs or 0) > 1 else "--processes")
+        )
+    recursive = args.R and not (args.dry_run or args.state_file or args.policy)
+    if recursive and (args.verbose or args.changes) and parallel:
+        parser.error("-v and -c cannot be combined with -j or --processes")
+    if filtered and (args.policy or args.state_file):
+        parser.error(
+            "--include, --exclude, --max-depth, -x and --symlinks cannot be combined with "
+            + ("--policy" if args.policy else "--state-file")
+        )
+    if args.policy:
+        if args.dry_run:
+            parser.error("--dry-run cannot be combined with --policy")
+        if not operands:
+            parser.error("--policy takes directories instead of mode and objects")
+        try:
+            policy = oschmod.ModePolicy.load(args.policy, first_match=not args.last_match_wins)
+        except (AttributeError, OSError, ValueError) as exc:
+            parser.error(f"cannot load policy: {exc}")
+        return _run_targets(
+            args,
+            operands,
+            lambda target, counts: oschmod.apply_policy(
+                target, policy, only_changes=args.changes_only, counts=counts
+            ),
+        )
+
+    if args.reference:
+        try:
+            mode = oschmod.ModeSpec.compile(oschmod.get_mode(args.reference))
+        except OSError as exc:
+            parser.error(f"cannot get the mode of the reference: {exc}")
+        targets = operands
+    else:
+        mode = _compile_mode(parser, args.mode) if args.mode is not None else None
+        targets = args.objects
+    if args.files_from:
+        if args.R:
+            parser.error("--files-from cannot be combined with -R")
+        if mode is None:
+            parser.error("the following arguments are required: mode")
+        listed = itertools.chain(targets, _read_paths(args.files_from, args.null))
+        if not (args.verbose or args.changes or args.dry_run):
+            return _run_bulk(args, listed, mode)
+        targets = listed
+    elif not targets:
+        parser.error("the following arguments are required: mode, object")
+
+    if args.dry_run:
+        return _run_plan(args, targets, mode)
+
+    if args.R and args.state_file:
+        return _run_targets(
+            args,
+            targets,
+            lambda target, counts: oschmod.set_mode_incremental(
+                target,
+                mode,
+                args.state_file,
+                full=args.full,
+                only_changes=args.changes_only,
+                counts=counts,
+            ),
+        )
     if args.R:
-        oschmod.set_mode_recursive(obj, mode)
+        walker = oschmod.ModeWalker[args.walker.upper()]
+        return _run_targets(
+            args,
+            targets,
+            lambda target, counts: oschmod.set_mode_recursive(
+                target,
+                mode,
+                walker=walker,
+                only_changes=args.changes_only,
+                counts=counts,
+                workers=args.jobs,
+                processes=args.processes,
+                **_get_filters(args),
+            ),
+        )
+    return _run_targets(
+        args,
+        targets,
+        lambda target, counts: oschmod.set_mode(
+            target, mode, only_changes=args.changes_only, counts=counts
+        ),
+    )
+
+
+METRICS = {
+    "entries_scanned": "Objects visited by the last run.",
+    "entries_changed": "Objects whose mode was set by the last run.",
+    "entries_unchanged": "Objects already at their target mode in the last run.",
+    "errors": "Errors in the last run.",
+    "duration_seconds": "Duration of the last run in seconds.",
+    "entries_per_second": "Objects visited per second by the last run.",
+    "last_run_timestamp_seconds": "Unix time the last run finished.",
+    "success": "Whether the last run finished without error.",
+}
+READ_SIZE = 65536
+
+
+def _run_targets(args, targets, run):
+    """Run a mode-setting function on each target, reporting as requested.
+
+    An error on one target is reported and the next target is processed;
+    the exit status is 1 if there was any error.
+    """
+    errors = []
+
+    def on_error(path, exc):
+        errors.append(exc)
+        print(f"oschmod: {path}: {exc}", file=sys.stderr)
+
+    counts = None
+    reporting = args.verbose or args.changes
+    if reporting or args.metrics_file:
+        # only the single-threaded engine is instrumented, so parallel runs only count for metrics
+        parallel = (args.jobs or 0) > 1 or (args.processes or 0) > 1
+        if reporting or not parallel:
+            counts = oschmod.RunStats(
+                on_entry=functools.partial(_report, args.verbose) if reporting else None,
+                on_error=on_error,
+            )
+        else:
+            counts = oschmod.ModeCounts()
+
+    start = time.perf_counter()
+    completed = False
+    try:
+        # targets listed together often share directories, resolved once for the whole run
+        with oschmod.path_cache():
+            for target in targets:
+                try:
+                    run(target, counts)
+                except (OSError, ValueError) as exc:
+                    errors.append(exc)
+                    print(f"oschmod: {exc}", file=sys.stderr)
+        completed = True
+    finally:
+        if args.metrics_file:
+            failures = len(errors) + (0 if completed else 1)
+            _write_run_metrics(args, counts, failures, time.perf_counter() - start)
+    return 1 if errors else 0
+
+
+def _run_plan(args, targets, mode):
+    """Print the changes setting modes of targets would make, as JSON lines."""
+    counts = oschmod.ModeCounts()
+    errors = []
+
+    def onerror(exc):
+        errors.append(exc)
+        print(f"oschmod: {exc}", file=sys.stderr)
+
+    for target in targets:
+        try:
+            if args.R:
+                plan = oschmod.plan_mode_recursive(
+                    target,
+                    mode,
+                    walker=oschmod.ModeWalker[args.walker.upper()],
+                    counts=counts,
+                    onerror=onerror,
+                    **_get_filters(args),
+                )
+            else:
+                old_mode = oschmod.get_mode(target)
+                plan = [oschmod.ModePlanEntry(target, old_mode, mode.apply(old_mode))]
+                counts += oschmod.ModeCounts(*((1, 0) if plan[0].changed else (0, 1)))
+            for planned in plan:
+                if planned.changed or args.verbose:
+                    line = {
+                        "path": _display_path(planned.path),
+                        "old_mode": f"{planned.old:03o}",
+                        "new_mode": f"{planned.new:03o}",
+                    }
+                    print(json.dumps(line))
+        except (OSError, ValueError) as exc:
+            onerror(exc)
+
+    print(
+        f"oschmod: dry run: {counts.changed} to change, {counts.unchanged} unchanged",
+        file=sys.stderr,
+    )
+    return 1 if errors else 0
+
+
+def _run_bulk(args, paths, mode):
+    """Set the mode of a stream of objects with the bulk engine."""
+    errors = 0
+    counts = oschmod.ModeCounts() if args.metrics_file else None
+    start = time.perf_counter()
+    completed = False
+    try:
+        for _, result in oschmod.iter_set_modes(
+            paths, mode, workers=args.jobs, only_changes=args.changes_only, counts=counts
+        ):
+            if isinstance(result, Exception):
+                errors += 1
+                print(f"oschmod: {result}", file=sys.stderr)
+        completed = True
+    finally:
+        if args.metrics_file:
+            failures = errors + (0 if completed else 1)
+            _write_run_metrics(args, counts, failures, time.perf_counter() - start)
+    return 1 if errors else 0
+
+
+def _read_paths(source, null=False):
+    """Read paths separated by newlines (or NULs) from a file or stdin ('-'), lazily."""
+    stream = sys.stdin.buffer if source == "-" else open(source, "rb")  # pylint: disable=consider-using-with
+    separator = b"\0" if null else b"\n"
+    pending = b""
+    try:
+        while True:
+            chunk = stream.read(READ_SIZE)
+            if not chunk:
+                break
+            pieces = (pending + chunk).split(separator)
+            pending = pieces.pop()
+            for piece in pieces:
+                if piece:
+                    yield os.fsdecode(piece)
+        if pending:
+            yield os.fsdecode(pending)
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+
+
+def _compile_mode(parser, mode):
+    """Compile a mode given on the command line, exiting with a usage error if invalid."""
+    try:
+        return oschmod.ModeSpec.compile(mode)
+    except (AttributeError, ValueError):
+        return parser.error(f"invalid mode: '{mode}'")
+
+
+def _get_filters(args):
+    """Get keyword arguments filtering recursive walks."""
+    return {
+        "include": args.include,
+        "exclude": args.exclude,
+        "max_depth": args.max_depth,
+        "one_file_system": args.one_file_system,
+        "symlinks": args.symlinks,
+    }
+
+
+def _report(verbose, path, old_mode, new_mode):
+    """Report the mode of an object, like GNU chmod -v/-c."""
+    path = _display_path(path)
+    old = f"{old_mode:04o} ({stat.filemode(old_mode)[1:]})"
+    if old_mode != new_mode:
+        new = f"{new_mode:04o} ({stat.filemode(new_mode)[1:]})"
+        print(f"mode of '{path}' changed from {old} to {new}")
+    elif verbose:
+        print(f"mode of '{path}' retained as {old}")
+
+
+def _display_path(path):
+    """Shorten absolute paths below the working directory to relative paths."""
+    cwd = os.getcwd()
+    if path.startswith(cwd + os.sep):
+        return os.path.relpath(path, cwd)
+    return path
+
+
+def _write_run_metrics(args, counts, errors, duration):
+    """Write metrics of a run to the --metrics-file."""
+    # only instrumented runs count visits, which include objects in error
+    scanned = max(counts.total, getattr(counts, "visited", 0))
+    metrics = {
+        "entries_scanned": scanned,
+        "entries_changed": counts.changed,
+        "entries_unchanged": counts.unchanged,
+        "errors": errors,
+        "duration_seconds": duration,
+        "entries_per_second": scanned / duration if duration else 0.0,
+        "last_run_timestamp_seconds": time.time(),
+        "success": int(not errors),
+    }
+    fmt = args.metrics_format or ("json" if args.metrics_file.endswith(".json") else "prometheus")
+    write_metrics(args.metrics_file, metrics, fmt)
+
+
+def write_metrics(path, metrics, fmt="prometheus"):
+    """Write metrics atomically, in Prometheus text format or as JSON.
+
+    Metrics are written to a temporary file in the same directory, which
+    then replaces path, so readers (such as the node_exporter textfile
+    collector) never see a partial file.
+    """
+    if fmt == "json":
+        text = json.dumps(metrics, indent=2) + "\n"
     else:
-        oschmod.set_mode(obj, mode)
+        lines = []
+        for name, value in metrics.items():
+            lines.append(f"# HELP oschmod_{name} {METRICS[name]}")
+            lines.append(f"# TYPE oschmod_{name} gauge")
+            lines.append(f"oschmod_{name} {value}")
+        text = "\n".join(lines) + "\n"
+
+    directory, name = os.path.split(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", dir=directory, prefix=f".{name}.", delete=False
+    ) as metrics_file:
+        metrics_file.write(text)
+    try:
+        os.chmod(metrics_file.name, 0o644)
+        os.replace(metrics_file.name, path)
+    except OSError:
+        os.remove(metrics_file.name)
+        raise
+
+
+def snapshot(argv):
+    """Save modes of a tree to a manifest."""
+    parser = argparse.ArgumentParser(
+        prog="oschmod snapshot", description="Save modes of a tree to a manifest"
+    )
+    parser.add_argument("-z", "--compress", action="store_true", help="gzip the manifest")
+    parser.add_argument(
+        "-L", "--follow-symlinks", action="store_true", help="follow symbolic links"
+    )
+    parser.add_argument("root", help="directory (or file) to save")
+    parser.add_argument("manifest", help="manifest file to write")
+
+    args = parser.parse_args(argv)
+    oschmod.snapshot_modes(args.root, args.manifest, args.compress, args.follow_symlinks)
+    return 0
+
+
+def restore(argv):
+    """Restore modes of a tree from a manifest."""
+    parser = argparse.ArgumentParser(
+        prog="oschmod restore", description="Restore modes of a tree from a manifest"
+    )
+    parser.add_argument("manifest", help="manifest file written by 'oschmod snapshot'")
+    parser.add_argument("root", help="directory (or file) to restore")
+
+    args = parser.parse_args(argv)
+    errors = []
+
+    def onerror(exc):
+        errors.append(exc)
+        print(f"oschmod: {exc}", file=sys.stderr)
+
+    oschmod.restore_modes(args.manifest, args.root, onerror=onerror)
+    return 1 if errors else 0
+
+
+def diff(argv):
+    """Report differences between a manifest and a tree as JSON lines."""
+    parser = argparse.ArgumentParser(
+        prog="oschmod diff",
+        description="Report differences between a manifest and a tree as JSON lines",
+    )
+    parser.add_argument(
+        "-L", "--follow-symlinks", action="store_true", help="follow symbolic links"
+    )
+    parser.add_argument("manifest", help="manifest file written by 'oschmod snapshot'")
+    parser.add_argument("root", help="directory (or file) to compare")
+
+    args = parser.parse_args(argv)
+    status = 0
+    for difference in oschmod.diff_modes(args.manifest, args.root, args.follow_symlinks):
+        status = 1
+        line = {"path": difference.path, "change": difference.change.name.lower()}
+        if difference.old is not None:
+            line["old_mode"] = f"{difference.old.mode:03o}"
+            line["old_type"] = difference.old.object_type.name.lower()
+        if difference.new is not None:
+            line["new_mode"] = f"{difference.new.mode:03o}"
+            line["new_type"] = difference.new.object_type.name.lower()
+        print(json.dumps(line))
+    return status
+
+
+def watch(argv):
+    """Set modes of objects created in a tree until interrupted (Linux)."""
+    parser = argparse.ArgumentParser(
+        prog="oschmod watch",
+        description="Set modes of objects created in or moved into a tree until interrupted",
+    )
+    parser.add_argument("-d", "--dir-mode", help="mode given to directories instead")
+    parser.add_argument(
+        "--no-initial", action="store_true", help="do not set modes of the existing tree first"
+    )
+    parser.add_argument(
+        "--coalesce",
+        type=float,
+        default=oschmod.watch.DEFAULT_COALESCE,
+        help="seconds to wait after an event before setting modes",
+    )
+    parser.add_argument("mode", help="mode given to files")
+    parser.add_argument("root", help="directory to watch")
+
+    args = parser.parse_args(argv)
+    mode = _compile_mode(parser, args.mode)
+    dir_mode = _compile_mode(parser, args.dir_mode) if args.dir_mode else None
+    errors = []
+
+    def onerror(exc):
+        errors.append(exc)
+        print(f"oschmod: {exc}", file=sys.stderr)
+
+    try:
+        oschmod.watch.watch_and_enforce(
+            args.root,
+            mode,
+            dir_mode,
+            initial=not args.no_initial,
+            coalesce=args.coalesce,
+            onerror=onerror,
+        )
+    except KeyboardInterrupt:
+        pass
+    except (NotImplementedError, OSError) as exc:
+        print(f"oschmod: {exc}", file=sys.stderr)
+        return 1
+    return 1 if errors else 0
+
+
+COMMANDS = {
+    "diff": diff,
+    "restore": restore,
+    "snapshot": snapshot,
+    "watch": watch,
+}
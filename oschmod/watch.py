@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""Enforce modes on a directory tree as objects appear (Linux inotify).
+
+`watch_and_enforce()` sets the modes of a tree once, then waits for inotify
+events and sets the mode of each object created in or moved into the tree,
+so the cost of enforcement follows the rate of change rather than the size
+of the tree:
+
+    stop = threading.Event()
+    threading.Thread(target=oschmod.watch.watch_and_enforce,
+                     args=("uploads", "u=rw,go=r", "u=rwx,go=rx", stop)).start()
+
+inotify is used directly through ctypes, so nothing but the C library is
+needed. Events are coalesced for a short delay before modes are set, and if
+more objects are pending than allowed (or the kernel queue overflows), the
+pending objects are dropped in favor of a full pass over the tree.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import stat
+import struct
+import sys
+import threading
+import time
+from typing import Callable, Dict, Final, Iterator, List, Optional, Tuple
+
+from oschmod import (
+    ModeCounts,
+    ModeInputValue,
+    ModePathInput,
+    ModePathInternal,
+    ModeSpec,
+    ModeSymlinks,
+    _set_mode,
+    _to_path,
+    set_mode_recursive,
+)
+
+IN_MOVED_TO: Final[int] = 0x00000080
+IN_CREATE: Final[int] = 0x00000100
+IN_Q_OVERFLOW: Final[int] = 0x00004000
+IN_IGNORED: Final[int] = 0x00008000
+IN_ONLYDIR: Final[int] = 0x01000000
+IN_DONT_FOLLOW: Final[int] = 0x02000000
+IN_EXCL_UNLINK: Final[int] = 0x04000000
+IN_NONBLOCK: Final[int] = 0o4000
+IN_CLOEXEC: Final[int] = 0o2000000
+
+WATCH_MASK: Final[int] = IN_CREATE | IN_MOVED_TO | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+DEFAULT_COALESCE: Final[float] = 0.1
+DEFAULT_MAX_PENDING: Final[int] = 65536
+POLL_INTERVAL: Final[float] = 0.5
+READ_SIZE: Final[int] = 65536
+
+_EVENT_HEADER: Final[struct.Struct] = struct.Struct("iIII")
+
+
+class Inotify:
+    """Minimal inotify instance, through the C library."""
+
+    __slots__ = ("fd", "_libc")
+
+    def __init__(self) -> None:
+        """Create a non-blocking inotify instance."""
+        if not sys.platform.startswith("linux"):
+            raise NotImplementedError("watching requires Linux inotify")
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd: int = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+    def __repr__(self) -> str:
+        """Return string representation."""
+        return f"Inotify(fd={self.fd})"
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        """Watch a directory, returning its watch descriptor."""
+        wd: int = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def read_events(self) -> Iterator[Tuple[int, int, str]]:
+        """Read available events as (watch descriptor, mask, name) tuples."""
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, size = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset : offset + size].rstrip(b"\0")
+            offset += size
+            yield wd, mask, os.fsdecode(name)
+
+    def close(self) -> None:
+        """Close the instance, removing all its watches."""
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def watch_and_enforce(  # pylint: disable=too-many-arguments,too-many-locals
+    path: ModePathInput,
+    mode: ModeInputValue,
+    dir_mode: Optional[ModeInputValue] = None,
+    stop: Optional[threading.Event] = None,
+    initial: bool = True,
+    coalesce: float = DEFAULT_COALESCE,
+    max_pending: int = DEFAULT_MAX_PENDING,
+    counts: Optional[ModeCounts] = None,
+    onerror: Optional[Callable[[OSError], None]] = None,
+) -> ModeCounts:
+    """Set modes of objects created in or moved into a tree until stopped.
+
+    Args:
+    ----
+    path: (:obj:`str`)
+        Directory to watch, with all its subdirectories (new ones included).
+
+    mode: (`int`, `str` or `ModeSpec`)
+        Mode given to files.
+
+    dir_mode: (`int`, `str` or `ModeSpec`)
+        If provided, this mode is given to directories instead.
+
+    stop: (`threading.Event`)
+        Watching stops once this is set (checked at least every half a
+        second). Without it, watching only stops on an exception, such as
+        `KeyboardInterrupt`.
+
+    initial: (`bool`)
+        If True, the modes of the whole tree are set once watches are in
+        place, so objects created before watching started are covered.
+
+    coalesce: (`float`)
+        Seconds to wait after an event before setting modes, so bursts of
+        events set each object once.
+
+    max_pending: (`int`)
+        Maximum number of objects waiting to be set; beyond it, they are
+        dropped in favor of a full pass over the tree.
+
+    counts: (`ModeCounts`)
+        If provided, incremented with the number of objects changed and
+        left unchanged.
+
+    onerror: (`callable`)
+        Called with errors setting modes or watching directories, instead of
+        raising them. Objects removed before they could be set are ignored.
+
+    Symbolic links are never followed: links created in the tree are left
+    alone and linked directories are not watched.
+
+    """
+    root = _to_path(path)
+    file_spec = ModeSpec.compile(mode)
+    dir_spec = ModeSpec.compile(dir_mode) if dir_mode else file_spec
+    total = ModeCounts()
+    watches: Dict[int, str] = {}
+    inotify = Inotify()
+
+    def handle_error(exc: OSError) -> None:
+        if isinstance(exc, FileNotFoundError):
+            return
+        if onerror is None:
+            raise exc
+        onerror(exc)
+
+    def watch_tree(top: str) -> None:
+        for dir_path, _, _ in os.walk(top, onerror=handle_error):
+            try:
+                watches[inotify.add_watch(dir_path)] = dir_path
+            except OSError as exc:
+                handle_error(exc)
+
+    def enforce(paths: List[str]) -> None:
+        for one_path in paths:
+            try:
+                mode_bits = os.lstat(one_path).st_mode
+                if stat.S_ISDIR(mode_bits):
+                    # watch first, so objects created meanwhile are caught by the pass below
+                    watch_tree(one_path)
+                    set_mode_recursive(
+                        one_path, file_spec, dir_spec, counts=total, symlinks=ModeSymlinks.SKIP
+                    )
+                elif not stat.S_ISLNK(mode_bits):
+                    _set_mode(ModePathInternal(one_path), file_spec, counts=total)
+            except OSError as exc:
+                handle_error(exc)
+
+    try:
+        watch_tree(root)
+        if initial:
+            enforce([root])
+
+        pending: Dict[str, None] = {}
+        deadline = 0.0
+        full_pass = False
+        while stop is None or not stop.is_set():
+            timeout = max(deadline - time.monotonic(), 0.0) if pending else POLL_INTERVAL
+            readable, _, _ = select.select([inotify.fd], [], [], timeout)
+            if readable:
+                for wd, event_mask, name in inotify.read_events():
+                    if event_mask & IN_Q_OVERFLOW:
+                        full_pass = True
+                    elif event_mask & IN_IGNORED:
+                        watches.pop(wd, None)
+                    elif wd in watches and name:
+                        if not pending:
+                            deadline = time.monotonic() + coalesce
+                        pending[os.path.join(watches[wd], name)] = None
+                if len(pending) > max_pending:
+                    full_pass = True
+
+            if full_pass:
+                pending.clear()
+                full_pass = False
+                enforce([root])
+            elif pending and time.monotonic() >= deadline:
+                paths = list(pending)
+                pending.clear()
+                enforce(paths)
+    finally:
+        inotify.close()
+        if counts is not None:
+            counts += total
+    return total
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""test_aio module."""
+
+import asyncio
+import os
+import sys
+
+try:
+    import oschmod.aio  # pylint: disable=import-error
+except ImportError:
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+    import oschmod.aio
+
+
+def _make_tree(topdir: str, count: int) -> None:
+    """Create a tree with a few directories and files."""
+    for index in range(count):
+        os.makedirs(os.path.join(topdir, f"dir{index}", "sub"))
+        with open(os.path.join(topdir, f"dir{index}", "sub", "file"), "w+", encoding="utf-8"):
+            pass
+        with open(os.path.join(topdir, f"file{index}"), "w+", encoding="utf-8"):
+            pass
+
+
+def test_aio_set_get_mode(test_dir: str) -> None:
+    """Check modes are set and read without blocking the event loop."""
+    file_path = os.path.join(test_dir, "file1")
+    with open(file_path, "w+", encoding="utf-8") as file_handle:
+        file_handle.write("contents")
+
+    async def run() -> int:
+        await oschmod.aio.set_mode(file_path, 0o600)
+        await oschmod.aio.set_mode(file_path, "g+r")
+        return await oschmod.aio.get_mode(file_path)
+
+    assert asyncio.run(run()) == 0o640
+
+
+def test_aio_set_recursive(test_dir: str) -> None:
+    """Check modes are set recursively with progress."""
+    topdir = os.path.join(test_dir, "testdir1")
+    _make_tree(topdir, 10)
+
+    async def run() -> list:
+        progress = []
+        async for path, mode in oschmod.aio.iter_set_mode_recursive(
+            topdir, "u=rw,go=", "u=rwx,go=rx", limit=3
+        ):
+            progress.append((path, mode))
+        return progress
+
+    progress = asyncio.run(run())
+    assert len(progress) == 41
+    assert progress[-1] == (topdir, 0o755)
+    assert oschmod.get_mode(os.path.join(topdir, "dir3", "sub")) == 0o755
+    assert oschmod.get_mode(os.path.join(topdir, "dir3", "sub", "file")) == 0o600
+    assert oschmod.get_mode(os.path.join(topdir, "file3")) == 0o600
+
+    assert asyncio.run(oschmod.aio.set_mode_recursive(topdir, 0o644, 0o700)) == 0o700
+    assert oschmod.get_mode(os.path.join(topdir, "dir3", "sub", "file")) == 0o644
+
+
+def test_aio_set_recursive_cancel(test_dir: str) -> None:
+    """Check a recursive operation stops when cancelled."""
+    topdir = os.path.join(test_dir, "testdir1")
+    _make_tree(topdir, 10)
+    oschmod.set_mode_recursive(topdir, 0o600, 0o700)
+
+    async def run() -> int:
+        seen = 0
+        started = asyncio.Event()
+
+        async def walk() -> None:
+            nonlocal seen
+            async for _ in oschmod.aio.iter_set_mode_recursive(topdir, 0o644, 0o755, limit=1):
+                seen += 1
+                started.set()
+                await asyncio.sleep(0.05)
+
+        task = asyncio.ensure_future(walk())
+        await started.wait()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return seen
+
+    assert asyncio.run(run()) < 41
+    assert oschmod.get_mode(topdir) == 0o700
@@ -2,15 +2,21 @@
 # pylint: disable=redefined-outer-name
 """test_oschmod module."""
 
+import array
 import glob
+import json
 import os
 import random
 import shutil
 import stat
 import string
+import subprocess
 import sys
 import time
 from random import randrange
+from typing import Any, List
+
+import pytest  # type: ignore[import-not-found]  # pylint: disable=import-error
 
 try:
     import oschmod  # pylint: disable=import-error
@@ -18,6 +24,8 @@ except ImportError:
     sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
     import oschmod
 
+import oschmod.cli  # pylint: disable=import-error,wrong-import-position
+
 
 def test_permissions(test_dir: str) -> None:
     """Tests for stuff."""
@@ -416,3 +424,770 @@ def test_symbolic_use(test_dir: str) -> None:
     assert oschmod.get_mode(testdir) == dir_mode
     assert oschmod.get_mode(os.path.join(topdir, "file1")) == file_mode
     assert oschmod.get_mode(os.path.join(testdir, "file2")) == file_mode
+
+
+def test_mode_spec_compile() -> None:
+    """Check compiled mode specs match the per-call calculation."""
+    spec = oschmod.ModeSpec.compile("u+rw,go-w")
+    assert spec is oschmod.ModeSpec.compile("u+rw,go-w")
+    assert spec is oschmod.ModeSpec.compile(spec)
+    assert spec.is_symbolic
+    for current in range(512):
+        assert spec.apply(current) == oschmod.get_effective_mode(current, "u+rw,go-w")
+        assert oschmod.get_effective_mode(current, spec) == spec.apply(current)
+
+    assert oschmod.ModeSpec.compile("o=rwx,ugo-,g=rx").apply(0b111110101) == 0b111101111
+    assert oschmod.ModeSpec.compile("go=").apply(0o4755) == 0o700
+
+    octal = oschmod.ModeSpec.compile("640")
+    assert not octal.is_symbolic
+    assert octal.apply(0o777) == 0o640
+    assert oschmod.ModeSpec.compile(0o4755).apply(0) == 0o4755
+
+
+def test_mode_spec_use(test_dir: str) -> None:
+    """Check compiled mode specs are accepted when setting modes."""
+    file_path = os.path.join(test_dir, "file1")
+    with open(file_path, "w+", encoding="utf-8") as file_handle:
+        file_handle.write("contents")
+
+    oschmod.set_mode(file_path, 0o600)
+    assert oschmod.set_mode(file_path, oschmod.ModeSpec.compile("g+r,o+r")) == 0o644
+    assert oschmod.get_mode(file_path) == 0o644
+    oschmod.set_mode_recursive(test_dir, oschmod.ModeSpec.compile("go-r"), "700")
+    assert oschmod.get_mode(file_path) == 0o600
+    assert oschmod.get_mode(test_dir) == 0o700
+
+
+def _make_tree(topdir: str) -> None:
+    """Create a small tree of directories and files."""
+    testdir = os.path.join(topdir, "testdir2", "testdir3")
+    os.makedirs(testdir, exist_ok=True)
+    for file_path in (os.path.join(topdir, "file1"), os.path.join(testdir, "file2")):
+        with open(file_path, "w+", encoding="utf-8") as file_handle:
+            file_handle.write("contents")
+
+
+@pytest.mark.skipif(not oschmod.HAS_DIR_FD, reason="requires dir_fd support")
+def test_set_recursive_walkers(test_dir: str) -> None:
+    """Check the scandir and os.walk engines give the same modes."""
+    for walker in (oschmod.ModeWalker.SCANDIR, oschmod.ModeWalker.WALK):
+        topdir = os.path.join(test_dir, walker.name)
+        _make_tree(topdir)
+        oschmod.set_mode_recursive(topdir, 0o640, 0o750, walker=walker)
+        oschmod.set_mode_recursive(topdir, "u+x,o=r", walker=walker)
+
+        assert oschmod.get_mode(topdir) == 0o754
+        assert oschmod.get_mode(os.path.join(topdir, "testdir2", "testdir3")) == 0o754
+        assert oschmod.get_mode(os.path.join(topdir, "file1")) == 0o744
+        assert oschmod.get_mode(os.path.join(topdir, "testdir2", "testdir3", "file2")) == 0o744
+
+
+def test_set_recursive_only_changes(test_dir: str) -> None:
+    """Check unchanged objects are counted and not modified."""
+    topdir = os.path.join(test_dir, "testdir1")
+    _make_tree(topdir)
+    oschmod.set_mode_recursive(topdir, 0o600, 0o700)
+    oschmod.set_mode(os.path.join(topdir, "file1"), 0o644)
+
+    counts = oschmod.ModeCounts()
+    oschmod.set_mode_recursive(topdir, 0o600, 0o700, only_changes=True, counts=counts)
+    assert counts == oschmod.ModeCounts(changed=1, unchanged=4)
+    assert oschmod.get_mode(os.path.join(topdir, "file1")) == 0o600
+
+    counts = oschmod.ModeCounts()
+    oschmod.set_mode_recursive(
+        topdir, "u=rw", "u=rwx", walker=oschmod.ModeWalker.WALK, only_changes=True, counts=counts
+    )
+    assert counts == oschmod.ModeCounts(changed=0, unchanged=5)
+
+
+def test_set_recursive_workers(test_dir: str) -> None:
+    """Check modes are set recursively by a pool of threads."""
+    topdir = os.path.join(test_dir, "testdir1")
+    _make_tree(topdir)
+    for index in range(20):
+        os.makedirs(os.path.join(topdir, f"dir{index}", "sub"))
+        with open(os.path.join(topdir, f"dir{index}", "sub", "file"), "w+", encoding="utf-8"):
+            pass
+
+    counts = oschmod.ModeCounts()
+    oschmod.set_mode_recursive(topdir, "u=rw,go=", 0o500, workers=4, counts=counts)
+    assert counts == oschmod.ModeCounts(changed=65)
+    assert oschmod.get_mode(topdir) == 0o500
+    assert oschmod.get_mode(os.path.join(topdir, "dir7", "sub")) == 0o500
+    assert oschmod.get_mode(os.path.join(topdir, "dir7", "sub", "file")) == 0o600
+    assert oschmod.get_mode(os.path.join(topdir, "testdir2", "testdir3", "file2")) == 0o600
+
+
+def test_set_recursive_processes(test_dir: str) -> None:
+    """Check modes are set recursively by a pool of processes."""
+    topdir = os.path.join(test_dir, "testdir1")
+    _make_tree(topdir)
+    for index in range(3):
+        os.makedirs(os.path.join(topdir, f"dir{index}", "sub", "subsub", "subsubsub"))
+        with open(os.path.join(topdir, f"dir{index}", "file"), "w+", encoding="utf-8"):
+            pass
+
+    counts = oschmod.ModeCounts()
+    oschmod.set_mode_recursive(topdir, 0o640, "u=rx,go=", processes=2, counts=counts)
+    assert counts == oschmod.ModeCounts(changed=20)
+    assert oschmod.get_mode(topdir) == 0o500
+    assert oschmod.get_mode(os.path.join(topdir, "dir2", "sub", "subsub", "subsubsub")) == 0o500
+    assert oschmod.get_mode(os.path.join(topdir, "dir2", "file")) == 0o640
+    assert oschmod.get_mode(os.path.join(topdir, "testdir2", "testdir3", "file2")) == 0o640
+
+
+def test_set_modes(test_dir: str) -> None:
+    """Check modes of many paths are set with errors collected."""
+    topdir = os.path.join(test_dir, "testdir1")
+    _make_tree(topdir)
+    paths = [
+        os.path.join(topdir, "file1"),
+        os.path.join(topdir, "testdir2", "testdir3", "file2"),
+        os.path.join(topdir, "testdir2"),
+        os.path.join(topdir, "missing"),
+        os.path.join(topdir, "missing_dir", "file3"),
+    ]
+    oschmod.set_mode_recursive(topdir, 0o600, 0o700)
+
+    for workers, expected in (
+        (None, oschmod.ModeCounts(changed=3)),
+        (3, oschmod.ModeCounts(unchanged=3)),
+    ):
+        counts = oschmod.ModeCounts()
+        result = oschmod.set_modes(paths, "g+r", workers=workers, only_changes=True, counts=counts)
+        assert not result.ok
+        assert sorted(result.errors) == sorted(paths[3:])
+        assert isinstance(result.errors[paths[3]], FileNotFoundError)
+        assert result.modes == {paths[0]: 0o640, paths[1]: 0o640, paths[2]: 0o740}
+        assert counts == expected
+
+    assert oschmod.get_mode(paths[1]) == 0o640
+    assert oschmod.set_modes(paths[:2], 0o600).ok
+    assert oschmod.get_mode(paths[1]) == 0o600
+
+
+def test_set_modes_bad_paths(test_dir: str) -> None:
+    """Check paths are not normalized and bad paths do not stop the others."""
+    topdir = os.path.join(test_dir, "testdir1")
+    _make_tree(topdir)
+    other = os.path.join(test_dir, "other")
+    os.makedirs(other)
+    other_file = os.path.join(other, "file1")
+    with open(other_file, "w+", encoding="utf-8"):
+        pass
+    oschmod.set_mode_recursive(test_dir, 0o600, 0o700)
+    # "link/../file1" is file1 in the parent of the link's target (other), not in topdir
+    try:
+        os.symlink(os.path.join(other, "sub"), os.path.join(topdir, "link"))
+    except OSError:
+        pytest.skip("symbolic links are not supported")
+    os.makedirs(os.path.join(other, "sub"))
+
+    paths = [
+        os.path.join(topdir, "link", "..", "file1"),
+        os.path.join(topdir, "bad\0name"),
+        os.path.join(topdir, "file1"),
+    ]
+    for workers in (None, 2):
+        result = oschmod.set_modes(paths, "g+r", workers=workers)
+        assert sorted(result.errors) == [paths[1]]
+        assert isinstance(result.errors[paths[1]], ValueError)
+        assert result.modes == {paths[0]: 0o640, paths[2]: 0o640}
+        assert oschmod.get_mode(other_file) == 0o640
+        os.chmod(other_file, 0o600)
+
+    result = oschmod.set_modes([None, paths[2]], 0o644)  # type: ignore[list-item]
+    assert isinstance(result.errors["None"], TypeError)
+    assert oschmod.get_mode(paths[2]) == 0o644
+
+
+def test_to_path(test_dir: str) -> None:
+    """Check paths are resolved through symbolic links and checked."""
+    # pylint: disable=protected-access
+    topdir = os.path.join(test_dir, "testdir1")
+    _make_tree(topdir)
+    real_file = os.path.realpath(os.path.join(topdir, "testdir2", "testdir3", "file2"))
+    try:
+        os.symlink(os.path.join(topdir, "testdir2"), os.path.join(topdir, "link2"))
+        os.symlink(real_file, os.path.join(topdir, "link_file"))
+    except OSError:
+        pytest.skip("symbolic links are not supported")
+
+    assert oschmod._to_path(os.path.join(topdir, "link2", "testdir3", "file2")) == real_file
+    assert oschmod._to_path(os.path.join(topdir, "link_file")) == real_file
+    with pytest.raises(FileNotFoundError):
+        oschmod._to_path(os.path.join(topdir, "link2", "missing"))
+    with pytest.raises(FileNotFoundError):
+        oschmod.set_mode(os.path.join(topdir, "missing"), 0o600, resolve=False)
+
+    oschmod.set_mode(os.path.join(topdir, "link2", "testdir3", "file2"), 0o640, resolve=False)
+    assert oschmod.get_mode(real_file, resolve=False) == 0o640
+
+    # ".." after a link is the parent of its target, as for the kernel
+    os.symlink(os.path.join(topdir, "testdir2", "testdir3"), os.path.join(topdir, "link3"))
+    for parent in (topdir, os.path.join(topdir, "testdir2")):
+        with open(os.path.join(parent, "file4"), "w+", encoding="utf-8"):
+            pass
+        oschmod.set_mode(os.path.join(parent, "file4"), 0o600)
+    dotdot_path = os.path.join(topdir, "link3", os.pardir, "file4")
+    assert oschmod._to_path(dotdot_path) == os.path.realpath(
+        os.path.join(topdir, "testdir2", "file4")
+    )
+    oschmod.set_mode(dotdot_path, 0o640)
+    oschmod.set_mode(os.path.join(topdir, "link3", os.pardir, "file4"), "g+w", resolve=False)
+    assert oschmod.get_mode(os.path.join(topdir, "testdir2", "file4")) == 0o660
+    assert oschmod.get_mode(os.path.join(topdir, "file4")) == 0o600
+
+    # directories are only cached within path_cache(), so replaced links are seen
+    link_path = os.path.join(topdir, "link3", "file4")
+    os.rename(
+        os.path.join(topdir, "testdir2", "file4"),
+        os.path.join(topdir, "testdir2", "testdir3", "file4"),
+    )
+    first = os.path.realpath(link_path)
+    with oschmod.path_cache():
+        assert oschmod._to_path(link_path) == first
+        os.remove(os.path.join(topdir, "link3"))
+        os.symlink(topdir, os.path.join(topdir, "link3"))
+        assert oschmod._to_path(link_path) == first
+        oschmod.clear_path_cache()
+        assert oschmod._to_path(link_path) == os.path.realpath(os.path.join(topdir, "file4"))
+    os.remove(os.path.join(topdir, "link3"))
+    os.symlink(os.path.join(topdir, "testdir2", "testdir3"), os.path.join(topdir, "link3"))
+    assert oschmod._to_path(link_path) == first
+
+
+def test_iter_modes(test_dir: str) -> None:
+    """Check modes of a tree are listed top-down in sorted order."""
+    topdir = os.path.join(test_dir, "testdir1")
+    _make_tree(topdir)
+    oschmod.set_mode_recursive(topdir, 0o640, 0o750)
+    oschmod.set_mode(os.path.join(topdir, "file1"), 0o600)
+
+    records = list(oschmod.iter_modes(topdir))
+    assert [record.path for record in records] == [
+        ".",
+        "file1",
+        "testdir2",
+        os.path.join("testdir2", "testdir3"),
+        os.path.join("testdir2", "testdir3", "file2"),
+    ]
+    assert [record.mode for record in records] == [0o750, 0o600, 0o750, 0o750, 0o640]
+    assert records[1].object_type == oschmod.ModeObjectType.FILE
+    assert records[2].object_type == oschmod.ModeObjectType.DIRECTORY
+    assert records[4].uid == os.stat(os.path.join(topdir, "file1")).st_uid
+
+    try:
+        os.symlink(topdir, os.path.join(topdir, "testdir2", "loop"))
+    except OSError:
+        return
+    records = list(oschmod.iter_modes(topdir))
+    assert records[3].path == os.path.join("testdir2", "loop")
+    assert records[3].object_type == oschmod.ModeObjectType.LINK
+    records = list(oschmod.iter_modes(topdir, follow_symlinks=True))
+    assert len(records) == 6
+    assert records[3].object_type == oschmod.ModeObjectType.DIRECTORY
+
+
+def test_snapshot_restore(test_dir: str) -> None:
+    """Check modes are saved to a manifest and restored."""
+    topdir = os.path.join(test_dir, "testdir1")
+    _make_tree(topdir)
+    for index in range(10):
+        with open(os.path.join(topdir, f"file_{index:02d}"), "w+", encoding="utf-8"):
+            pass
+    oschmod.set_mode_recursive(topdir, 0o640, 0o750)
+    oschmod.set_mode(os.path.join(topdir, "file_03"), 0o604)
+    expected = list(oschmod.iter_modes(topdir))
+
+    for compress in (False, True):
+        manifest = os.path.join(test_dir, f"manifest{compress}")
+        assert oschmod.snapshot_modes(topdir, manifest, compress=compress) == 15
+        assert list(oschmod.iter_manifest(manifest)) == expected
+
+        oschmod.set_mode_recursive(topdir, 0o600, 0o700)
+        oschmod.set_mode(os.path.join(topdir, "file_07"), 0o640)
+        counts = oschmod.restore_modes(manifest, topdir)
+        assert counts == oschmod.ModeCounts(changed=14, unchanged=1)
+        assert list(oschmod.iter_modes(topdir)) == expected
+
+    os.remove(os.path.join(topdir, "file_05"))
+    errors: list = []
+    counts = oschmod.restore_modes(manifest, topdir, onerror=errors.append)
+    assert counts == oschmod.ModeCounts(unchanged=14)
+    assert len(errors) == 1
+    assert isinstance(errors[0], FileNotFoundError)
+
+
+def test_diff_modes(test_dir: str) -> None:
+    """Check differences between a manifest and a live tree."""
+    topdir = os.path.join(test_dir, "testdir1")
+    _make_tree(topdir)
+    os.makedirs(os.path.join(topdir, "testdir2-b"))
+    oschmod.set_mode_recursive(topdir, 0o640, 0o750)
+    manifest = os.path.join(test_dir, "manifest")
+    oschmod.snapshot_modes(topdir, manifest)
+    assert not list(oschmod.diff_modes(manifest, topdir))
+
+    os.remove(os.path.join(topdir, "file1"))
+    with open(os.path.join(topdir, "testdir2", "file3"), "w+", encoding="utf-8"):
+        pass
+    oschmod.set_mode(os.path.join(topdir, "testdir2", "testdir3", "file2"), 0o600)
+    with open(os.path.join(topdir, "zzz"), "w+", encoding="utf-8"):
+        pass
+
+    differences = [
+        (difference.path, difference.change) for difference in oschmod.diff_modes(manifest, topdir)
+    ]
+    assert differences == [
+        ("file1", oschmod.ModeChangeType.REMOVED),
+        (os.path.join("testdir2", "file3"), oschmod.ModeChangeType.ADDED),
+        (os.path.join("testdir2", "testdir3", "file2"), oschmod.ModeChangeType.CHANGED),
+        ("zzz", oschmod.ModeChangeType.ADDED),
+    ]
+
+
+def test_apply_policy(test_dir: str) -> None:
+    """Check setting modes from rules in a single walk."""
+    topdir = os.path.join(test_dir, "testdir1")
+    _make_tree(topdir)
+    os.makedirs(os.path.join(topdir, "other"))
+    with open(os.path.join(topdir, "other", "run.sh"), "w+", encoding="utf-8"):
+        pass
+    oschmod.set_mode_recursive(topdir, 0o600, 0o700)
+
+    policy_file = os.path.join(test_dir, "policy")
+    with open(policy_file, "w", encoding="utf-8") as policy:
+        policy.write("# comment\n*.sh 755 file\ntestdir2/** 640\ntestdir2/** 750 dir\n")
+    policy_rules = oschmod.ModePolicy.load(policy_file, first_match=False)
+    counts = oschmod.apply_policy(topdir, policy_rules)
+    assert counts.total == 3
+    assert oschmod.get_mode(os.path.join(topdir, "file1")) == 0o600
+    assert oschmod.get_mode(os.path.join(topdir, "other")) == 0o700
+    assert oschmod.get_mode(os.path.join(topdir, "other", "run.sh")) == 0o755
+    assert oschmod.get_mode(os.path.join(topdir, "testdir2", "testdir3")) == 0o750
+    assert oschmod.get_mode(os.path.join(topdir, "testdir2", "testdir3", "file2")) == 0o640
+    assert oschmod.get_mode(topdir) == 0o700
+
+    rules = [("testdir2/**", 0o604), ("**", 0o644, oschmod.ModeObjectType.FILE)]
+    oschmod.apply_policy(topdir, rules)
+    assert oschmod.get_mode(os.path.join(topdir, "file1")) == 0o644
+    assert oschmod.get_mode(os.path.join(topdir, "testdir2", "testdir3")) == 0o604
+    assert oschmod.get_mode(os.path.join(topdir, "testdir2", "testdir3", "file2")) == 0o604
+
+    prefixed = oschmod.ModePolicy([("testdir2/testdir3/*", 0o600)])
+    assert prefixed.can_match_below("testdir2")
+    assert not prefixed.can_match_below("other")
+    with pytest.raises(ValueError):
+        with open(policy_file, "w", encoding="utf-8") as policy:
+            policy.write("*.sh 755 link\n")
+        oschmod.ModePolicy.load(policy_file)
+
+
+def test_run_stats(test_dir: str) -> None:
+    """Check statistics and callbacks of an instrumented run."""
+    topdir = os.path.join(test_dir, "testdir1")
+    _make_tree(topdir)
+    oschmod.set_mode_recursive(topdir, 0o600, 0o700)
+
+    entries = []
+    dirs_done: List[str] = []
+    stats = oschmod.RunStats(
+        on_entry=lambda path, old, new: entries.append((path, old, new)),
+        on_dir_done=dirs_done.append,
+    )
+    for walker in (oschmod.ModeWalker.AUTO, oschmod.ModeWalker.WALK):
+        oschmod.set_mode_recursive(topdir, "u=rw,go=r", "u=rwx,go=rx", walker, True, stats)
+    assert stats.visited == 10
+    assert (stats.changed, stats.unchanged, stats.stats, stats.errors) == (5, 5, 10, 0)
+    assert stats.path_bytes > 0
+    assert stats.wall_time > 0 and set(stats.cpu_times) == set(oschmod.RUN_PHASES)
+    assert (os.path.join(topdir, "file1"), 0o600, 0o644) in entries
+    assert (os.path.join(topdir, "file1"), 0o644, 0o644) in entries
+    assert dirs_done[:3] == [
+        os.path.join(topdir, "testdir2", "testdir3"),
+        os.path.join(topdir, "testdir2"),
+        topdir,
+    ]
+
+    errors = []
+    stats = oschmod.RunStats(on_error=lambda path, exc: errors.append(path))
+    os.remove(os.path.join(topdir, "file1"))
+    try:
+        os.symlink(os.path.join(topdir, "missing"), os.path.join(topdir, "file1"))
+    except OSError:
+        pytest.skip("symbolic links are not supported")
+    oschmod.set_mode_recursive(topdir, "u+x", counts=stats)
+    assert errors == [os.path.join(topdir, "file1")]
+    assert (stats.visited, stats.errors, stats.changed) == (5, 1, 4)
+    with pytest.raises(OSError):
+        oschmod.set_mode_recursive(topdir, "u+x", counts=oschmod.RunStats())
+    os.remove(os.path.join(topdir, "file1"))
+
+    # only the single-threaded engine is instrumented, so parallel engines are refused
+    for workers, processes in ((2, None), (None, 2)):
+        with pytest.raises(ValueError):
+            oschmod.set_mode_recursive(
+                topdir, "u-x", counts=oschmod.RunStats(), workers=workers, processes=processes
+            )
+    with pytest.raises(SystemExit):
+        oschmod.cli.main(["-R", "-c", "-j", "2", "u-x", topdir])
+    assert oschmod.get_mode(topdir) == 0o755
+
+
+def _block_listing(monkeypatch: pytest.MonkeyPatch, name: str) -> None:
+    """Make directories with a name fail to open or list, as if unreadable."""
+    real_open, real_scandir = os.open, os.scandir
+
+    def failing_open(path: str, *args: Any, **kwargs: Any) -> int:
+        if os.path.basename(path) == name:
+            raise PermissionError(13, "Permission denied", path)
+        return real_open(path, *args, **kwargs)
+
+    def failing_scandir(path: Any = ".") -> Any:
+        if isinstance(path, str) and os.path.basename(path) == name:
+            raise PermissionError(13, "Permission denied", path)
+        return real_scandir(path)
+
+    monkeypatch.setattr(os, "open", failing_open)
+    monkeypatch.setattr(os, "scandir", failing_scandir)
+
+
+def test_set_recursive_listing_errors(test_dir: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Check every engine skips directories that cannot be listed, like os.walk."""
+    topdir = os.path.join(test_dir, "testdir1")
+    _make_tree(topdir)
+    blocked = os.path.join(topdir, "testdir2", "testdir3")
+    _block_listing(monkeypatch, "testdir3")
+    for kwargs in (
+        {"walker": oschmod.ModeWalker.AUTO},
+        {"walker": oschmod.ModeWalker.WALK},
+        {"workers": 2},
+        {"workers": 2, "walker": oschmod.ModeWalker.WALK},
+        {"exclude": ["other"]},
+    ):
+        oschmod.set_mode_recursive(topdir, 0o600, 0o700, walker=oschmod.ModeWalker.WALK)
+        counts = oschmod.ModeCounts()
+        oschmod.set_mode_recursive(topdir, 0o644, 0o755, counts=counts, **kwargs)
+        assert oschmod.get_mode(topdir) == 0o755
+        assert oschmod.get_mode(blocked) == 0o755
+        assert counts.changed == 4
+
+    plan = oschmod.plan_mode_recursive(topdir, 0o700)
+    assert len([planned for planned in plan if planned.changed]) == 4
+
+
+def test_run_stats_listing_errors(test_dir: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Check directories that cannot be listed are reported and skipped in instrumented runs."""
+    topdir = os.path.join(test_dir, "testdir1")
+    _make_tree(topdir)
+    blocked = os.path.join(topdir, "testdir2", "testdir3")
+    _block_listing(monkeypatch, "testdir3")
+    for walker in (oschmod.ModeWalker.AUTO, oschmod.ModeWalker.WALK):
+        errors: List[str] = []
+        stats = oschmod.RunStats(on_error=lambda path, exc: errors.append(path))
+        oschmod.set_mode_recursive(topdir, 0o750, walker=walker, counts=stats)
+        assert errors == [blocked]
+        assert (stats.visited, stats.errors, stats.changed) == (4, 1, 4)
+        stats = oschmod.RunStats()
+        oschmod.set_mode_recursive(topdir, 0o750, walker=walker, counts=stats)
+        assert (stats.visited, stats.errors, stats.changed) == (4, 1, 4)
+
+
+def test_cli_metrics_file(test_dir: str) -> None:
+    """Check metrics written by the command line interface."""
+    topdir = os.path.join(test_dir, "testdir1")
+    _make_tree(topdir)
+    metrics_file = os.path.join(test_dir, "oschmod.prom")
+    assert oschmod.cli.main(["-R", "--metrics-file", metrics_file, "644", topdir]) == 0
+    with open(metrics_file, encoding="utf-8") as metrics:
+        lines = metrics.read().splitlines()
+    assert "oschmod_entries_scanned 5" in lines
+    assert "oschmod_success 1" in lines
+    assert "# TYPE oschmod_errors gauge" in lines
+
+    metrics_file = os.path.join(test_dir, "oschmod.json")
+    missing = os.path.join(topdir, "nope")
+    assert oschmod.cli.main(["--metrics-file", metrics_file, "644", missing]) == 1
+    with open(metrics_file, encoding="utf-8") as metrics:
+        values = json.load(metrics)
+    assert (values["errors"], values["success"]) == (1, 0)
+    assert sorted(os.listdir(test_dir)) == ["oschmod.json", "oschmod.prom", "testdir1"]
+
+
+def test_cli_targets(test_dir: str, capsys: pytest.CaptureFixture) -> None:
+    """Check many targets, reporting and reference modes on the command line."""
+    topdir = os.path.join(test_dir, "testdir1")
+    _make_tree(topdir)
+    file1 = os.path.join(topdir, "file1")
+    file2 = os.path.join(topdir, "testdir2", "testdir3", "file2")
+    oschmod.set_mode_recursive(topdir, 0o600, 0o700)
+    capsys.readouterr()
+
+    assert oschmod.cli.main(["-c", "640", file1, os.path.join(topdir, "nope"), file2]) == 1
+    out, err = capsys.readouterr()
+    assert out.splitlines() == [
+        f"mode of '{file1}' changed from 0600 (rw-------) to 0640 (rw-r-----)",
+        f"mode of '{file2}' changed from 0600 (rw-------) to 0640 (rw-r-----)",
+    ]
+    assert "nope" in err
+
+    assert oschmod.cli.main(["-v", "--reference", file1, file1, topdir]) == 0
+    out, _ = capsys.readouterr()
+    assert out.splitlines() == [
+        f"mode of '{file1}' retained as 0640 (rw-r-----)",
+        f"mode of '{topdir}' changed from 0700 (rwx------) to 0640 (rw-r-----)",
+    ]
+    assert oschmod.get_mode(file2) == 0o640
+    oschmod.set_mode(topdir, 0o700)
+
+    with pytest.raises(SystemExit):
+        oschmod.cli.main(["--files-from", os.devnull])
+    assert "required: mode" in capsys.readouterr().err
+
+
+def test_cli_usage_errors(test_dir: str, capsys: pytest.CaptureFixture) -> None:
+    """Check invalid modes and policies are usage errors, not tracebacks."""
+    file1 = os.path.join(test_dir, "file1")
+    with open(file1, "w+", encoding="utf-8"):
+        pass
+    for argv in (
+        ["u+q", file1],
+        ["999", file1],
+        ["--reference", os.path.join(test_dir, "nope"), file1],
+        ["--policy", os.path.join(test_dir, "nope"), test_dir],
+        ["watch", "u+q", test_dir],
+    ):
+        with pytest.raises(SystemExit) as exit_info:
+            oschmod.cli.main(argv)
+        assert exit_info.value.code == 2
+        assert "error:" in capsys.readouterr().err
+
+
+def test_iter_set_modes(test_dir: str) -> None:
+    """Check setting modes of a stream of paths in batches."""
+    topdir = os.path.join(test_dir, "testdir1")
+    _make_tree(topdir)
+    file1 = os.path.join(topdir, "file1")
+    file2 = os.path.join(topdir, "testdir2", "testdir3", "file2")
+    missing = os.path.join(topdir, "nope")
+
+    counts = oschmod.ModeCounts()
+    results = dict(
+        oschmod.iter_set_modes(iter([file1, missing, file2]), 0o640, counts=counts, batch_size=2)
+    )
+    assert results[file1] == results[file2] == 0o640
+    assert isinstance(results[missing], OSError)
+    assert counts == oschmod.ModeCounts(changed=2)
+
+    list_file = os.path.join(test_dir, "list")
+    with open(list_file, "wb") as listed:
+        listed.write(os.fsencode(file1) + b"\0" + os.fsencode(file2) + b"\0")
+    assert oschmod.cli.main(["600", "--files-from", list_file, "-0"]) == 0
+    assert oschmod.get_mode(file1) == oschmod.get_mode(file2) == 0o600
+
+
+def test_cli_files_from_bad_paths(test_dir: str, capsys: pytest.CaptureFixture[str]) -> None:
+    """Check bad paths listed in --files-from are reported without stopping the others."""
+    topdir = os.path.join(test_dir, "testdir1")
+    _make_tree(topdir)
+    file1 = os.path.join(topdir, "file1")
+    file2 = os.path.join(topdir, "testdir2", "testdir3", "file2")
+    try:
+        os.symlink(os.path.join(topdir, "testdir2", "testdir3"), os.path.join(topdir, "link"))
+    except OSError:
+        pytest.skip("symbolic links are not supported")
+    # "link/../testdir3/file2" is file2 through the link's target parent (testdir2)
+    through_link = os.path.join(topdir, "link", "..", "testdir3", "file2")
+
+    list_file = os.path.join(test_dir, "list")
+    with open(list_file, "wb") as listed:
+        listed.write(b"\n".join(os.fsencode(one) for one in (file1, "bad\0name", through_link)))
+
+    for options in ([], ["-c"]):
+        oschmod.set_mode(file1, 0o600)
+        oschmod.set_mode(file2, 0o600)
+        assert oschmod.cli.main([*options, "640", "--files-from", list_file]) == 1
+        assert "null" in capsys.readouterr().err
+        assert oschmod.get_mode(file1) == oschmod.get_mode(file2) == 0o640
+
+
+def test_plan_mode_recursive(test_dir: str) -> None:
+    """Check planning recursive changes without making them."""
+    topdir = os.path.join(test_dir, "testdir1")
+    _make_tree(topdir)
+    oschmod.set_mode_recursive(topdir, 0o600, 0o700)
+    oschmod.set_mode(os.path.join(topdir, "file1"), 0o640)
+
+    for walker in (oschmod.ModeWalker.AUTO, oschmod.ModeWalker.WALK):
+        counts = oschmod.ModeCounts()
+        plan = list(oschmod.plan_mode_recursive(topdir, "g+r", walker=walker, counts=counts))
+        assert [planned.path for planned in plan][-1] == topdir
+        assert oschmod.ModePlanEntry(os.path.join(topdir, "file1"), 0o640, 0o640) in plan
+        assert (os.path.join(topdir, "testdir2"), 0o700, 0o740) in plan
+        assert counts == oschmod.ModeCounts(changed=4, unchanged=1)
+    assert oschmod.get_mode(os.path.join(topdir, "testdir2")) == 0o700
+
+
+def test_set_recursive_filters(test_dir: str) -> None:
+    """Check recursive changes leave out excluded, unincluded and too deep objects."""
+    topdir = os.path.join(test_dir, "testdir1")
+    _make_tree(topdir)
+    paths = {
+        name: os.path.join(topdir, *name.split("/"))
+        for name in ("file1", "testdir2", "testdir2/testdir3", "testdir2/testdir3/file2")
+    }
+    for kwargs, expected in (
+        ({"exclude": ["testdir3"]}, {"file1", "testdir2"}),
+        ({"max_depth": 1}, {"file1", "testdir2"}),
+        ({"include": ["file*"]}, {"file1", "testdir2/testdir3/file2"}),
+        ({"include": ["**"], "exclude": ["testdir2/*"]}, {"file1", "testdir2"}),
+        ({"one_file_system": True}, set(paths)),
+    ):
+        for walker in (oschmod.ModeWalker.AUTO, oschmod.ModeWalker.WALK):
+            oschmod.set_mode_recursive(topdir, 0o600, 0o700)
+            counts = oschmod.ModeCounts()
+            oschmod.set_mode_recursive(topdir, "g+r", walker=walker, counts=counts, **kwargs)
+            changed = {name for name, path in paths.items() if oschmod.get_mode(path) & 0o040}
+            assert changed == expected
+            assert counts.changed == len(expected) + 1
+            assert oschmod.get_mode(topdir) == 0o740
+
+    plan = oschmod.plan_mode_recursive(topdir, "g+r", exclude=["testdir2"])
+    assert [planned.path for planned in plan] == [paths["file1"], topdir]
+
+    # filters are applied in a single thread, so parallel engines are refused
+    for workers, processes in ((2, None), (None, 2)):
+        with pytest.raises(ValueError):
+            oschmod.set_mode_recursive(
+                topdir, "g-r", workers=workers, processes=processes, exclude=["testdir3"]
+            )
+        with pytest.raises(ValueError):
+            oschmod.set_mode_recursive(
+                topdir, "g-r", workers=workers, processes=processes, symlinks="skip"
+            )
+    assert oschmod.get_mode(topdir) == 0o740
+    with pytest.raises(SystemExit):
+        oschmod.cli.main(["-R", "-j", "2", "--exclude", "testdir3", "g-r", topdir])
+    assert oschmod.get_mode(topdir) == 0o740
+
+
+def test_set_recursive_symlinks(test_dir: str) -> None:
+    """Check symbolic links are followed, set themselves or skipped."""
+    topdir = os.path.join(test_dir, "testdir1")
+    _make_tree(topdir)
+    outside = os.path.join(test_dir, "outside")
+    with open(outside, "w+", encoding="utf-8"):
+        pass
+    try:
+        os.symlink(outside, os.path.join(topdir, "link_file"))
+        os.symlink(test_dir, os.path.join(topdir, "testdir2", "link_dir"))
+    except OSError:
+        pytest.skip("symbolic links are not supported")
+
+    for symlinks in ("skip", oschmod.ModeSymlinks.NO_FOLLOW, oschmod.ModeSymlinks.FOLLOW):
+        for walker in (oschmod.ModeWalker.AUTO, oschmod.ModeWalker.WALK):
+            oschmod.set_mode(outside, 0o600)
+            oschmod.set_mode(test_dir, 0o700)
+            counts = oschmod.ModeCounts()
+            oschmod.set_mode_recursive(
+                topdir, "go+r", walker=walker, counts=counts, symlinks=symlinks
+            )
+            followed = symlinks == oschmod.ModeSymlinks.FOLLOW
+            assert oschmod.get_mode(outside) == (0o644 if followed else 0o600)
+            assert oschmod.get_mode(test_dir) == (0o744 if followed else 0o700)
+            assert oschmod.get_mode(os.path.join(topdir, "testdir2", "testdir3", "file2")) & 0o044
+            assert counts.changed == (7 if followed or oschmod.HAS_LCHMOD else 5)
+
+    with pytest.raises(ValueError):
+        oschmod.set_mode_recursive(topdir, "go+r", symlinks="sometimes")
+    oschmod.set_mode(test_dir, 0o755)
+
+
+def test_name_cache(test_dir: str) -> None:
+    """Check caching of user and group names."""
+    lookups = []
+
+    def lookup(ident: int) -> str:
+        lookups.append(ident)
+        if ident == 2:
+            raise KeyError(ident)
+        return f"name{ident}"
+
+    cache = oschmod.NameCache(lookup, maxsize=2)
+    assert [cache.get(0), cache.get(0), cache.get(2), cache.get(2)] == [
+        "name0",
+        "name0",
+        None,
+        None,
+    ]
+    assert (cache.hits, cache.misses, lookups) == (2, 2, [0, 2])
+    cache.get(1)
+    cache.get(0)
+    assert lookups == [0, 2, 1, 0]
+    cache.invalidate(0)
+    cache.ttl = 0
+    cache.get(0)
+    cache.get(0)
+    assert lookups == [0, 2, 1, 0, 0, 0]
+
+    if oschmod.HAS_PWD:
+        oschmod.clear_name_cache()
+        record = next(oschmod.iter_modes(test_dir))
+        assert record.owner == oschmod.get_owner(test_dir)
+        assert record.group == oschmod.get_group(test_dir)
+        assert oschmod.USER_NAME_CACHE.hits >= 1
+
+
+def test_get_effective_modes() -> None:
+    """Check computing modes of many objects at once."""
+    current = [0o644, 0o600, stat.S_IFDIR | 0o755]
+    expected = [oschmod.get_effective_mode(one, "go-w,u+x") for one in current]
+    assert oschmod.get_effective_modes(current, "go-w,u+x") == expected
+    result = oschmod.get_effective_modes(array.array("H", current), "go-w,u+x")
+    assert isinstance(result, array.array) and result.tolist() == expected
+    assert oschmod.get_effective_modes(iter(current), 0o640) == [0o640] * 3
+
+    # NumPy is slow to import, so it is only imported when modes are computed
+    check = "import sys, oschmod; sys.exit('numpy' in sys.modules)"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    assert subprocess.run([sys.executable, "-c", check], cwd=root, check=False).returncode == 0
+
+    numpy = pytest.importorskip("numpy")
+    modes = numpy.array(current, dtype=numpy.uint32)
+    result = oschmod.get_effective_modes(modes, "go-w,u+x")
+    assert isinstance(result, numpy.ndarray)
+    assert result.dtype == modes.dtype and result.tolist() == expected
+
+
+def test_set_mode_incremental(test_dir: str) -> None:
+    """Check skipping directories unchanged since the last run."""
+    topdir = os.path.join(test_dir, "testdir1")
+    _make_tree(topdir)
+    state_file = os.path.join(test_dir, "state.db")
+    file1 = os.path.join(topdir, "file1")
+    testdir3 = os.path.join(topdir, "testdir2", "testdir3")
+    past = time.time() - 3600
+    for dir_path in (topdir, os.path.join(topdir, "testdir2"), testdir3):
+        os.utime(dir_path, (past, past))
+
+    counts = oschmod.set_mode_incremental(topdir, 0o640, state_file, 0o750)
+    assert counts == oschmod.ModeCounts(changed=5)
+    oschmod.set_mode(file1, 0o600)
+    assert oschmod.set_mode_incremental(topdir, 0o640, state_file, 0o750).total == 0
+    assert oschmod.get_mode(file1) == 0o600
+
+    with open(os.path.join(testdir3, "file3"), "w+", encoding="utf-8"):
+        pass
+    counts = oschmod.set_mode_incremental(topdir, 0o640, state_file, 0o750)
+    assert counts == oschmod.ModeCounts(changed=3)
+    assert oschmod.get_mode(os.path.join(testdir3, "file3")) == 0o640
+    assert oschmod.get_mode(file1) == 0o600
+
+    counts = oschmod.set_mode_incremental(topdir, 0o640, state_file, 0o750, full=True)
+    assert counts.total == 6
+    assert oschmod.get_mode(file1) == 0o640
+    counts = oschmod.set_mode_incremental(topdir, 0o644, state_file, 0o755, only_changes=True)
+    assert counts == oschmod.ModeCounts(changed=6)
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""test_watch module."""
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+try:
+    import oschmod.watch  # pylint: disable=import-error
+except ImportError:
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+    import oschmod.watch
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="requires inotify")
+
+
+def _wait_for_mode(path: str, mode: int) -> int:
+    """Wait a few seconds for an object to get a mode, returning its last mode."""
+    deadline = time.monotonic() + 5
+    while True:
+        current = oschmod.get_mode(path)
+        if current == mode or time.monotonic() > deadline:
+            return current
+        time.sleep(0.05)
+
+
+def test_watch_and_enforce(test_dir: str) -> None:
+    """Check modes are set on existing objects, then on objects as they appear."""
+    existing = os.path.join(test_dir, "existing")
+    with open(existing, "w+", encoding="utf-8"):
+        pass
+    os.chmod(existing, 0o600)
+    target = os.path.join(test_dir, "target")
+    with open(target, "w+", encoding="utf-8"):
+        pass
+    os.chmod(target, 0o600)
+
+    stop = threading.Event()
+    counts = oschmod.ModeCounts()
+    thread = threading.Thread(
+        target=oschmod.watch.watch_and_enforce,
+        args=(test_dir, "u=rw,go=r", "u=rwx,go=rx", stop),
+        kwargs={"coalesce": 0.01, "counts": counts},
+    )
+    # objects are created with their initial modes, so the watcher cannot set them first
+    umask = os.umask(0o077)
+    thread.start()
+    try:
+        assert _wait_for_mode(existing, 0o644) == 0o644
+        assert _wait_for_mode(target, 0o644) == 0o644
+        os.chmod(target, 0o600)
+
+        new_file = os.path.join(test_dir, "new")
+        with open(new_file, "w+", encoding="utf-8"):
+            pass
+        nested = os.path.join(test_dir, "dir", "sub")
+        os.makedirs(nested)
+        link = os.path.join(test_dir, "link")
+        os.symlink(target, link)
+        assert _wait_for_mode(new_file, 0o644) == 0o644
+        assert _wait_for_mode(nested, 0o755) == 0o755
+
+        # new directories are watched too
+        nested_file = os.path.join(nested, "file")
+        with open(nested_file, "w+", encoding="utf-8"):
+            pass
+        assert _wait_for_mode(nested_file, 0o644) == 0o644
+    finally:
+        os.umask(umask)
+        stop.set()
+        thread.join()
+
+    # links are not followed
+    assert oschmod.get_mode(target) == 0o600
+    os.remove(link)
+    assert counts.changed >= 6
+
+
+def test_watch_and_enforce_symlinks(test_dir: str) -> None:
+    """Check links existing before watching, or in moved-in directories, are not followed."""
+    tree = os.path.join(test_dir, "tree")
+    staging = os.path.join(test_dir, "staging")
+    os.makedirs(tree)
+    os.makedirs(staging)
+    outside = os.path.join(test_dir, "outside")
+    with open(outside, "w+", encoding="utf-8"):
+        pass
+    os.chmod(outside, 0o600)
+    staged_file = os.path.join(staging, "file")
+    with open(staged_file, "w+", encoding="utf-8"):
+        pass
+    os.chmod(staged_file, 0o600)
+    try:
+        os.symlink(outside, os.path.join(tree, "link"))
+        os.symlink(outside, os.path.join(staging, "link"))
+    except OSError:
+        pytest.skip("symbolic links are not supported")
+
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=oschmod.watch.watch_and_enforce,
+        args=(tree, "u=rw,go=r", "u=rwx,go=rx", stop),
+        kwargs={"coalesce": 0.01},
+    )
+    thread.start()
+    try:
+        assert _wait_for_mode(tree, 0o755) == 0o755
+        os.rename(staging, os.path.join(tree, "moved"))
+        assert _wait_for_mode(os.path.join(tree, "moved", "file"), 0o644) == 0o644
+    finally:
+        stop.set()
+        thread.join()
+
+    assert oschmod.get_mode(outside) == 0o600